@@ -0,0 +1,153 @@
+# Copyright (c) 2020 ifly6
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+from src.bench import synthetic
+from src.load_db import Database
+from src.reports import pandas_reports
+from src.reports.bbcode_reports import OrderType, generate_author_index, generate_author_table
+from src.reports.pandas_reports import create_leaderboards
+
+try:
+    from src.reports import author_stats
+except ImportError:  # trees from before author statistics were cached, so that their results can be compared
+    author_stats = None
+
+""" Times the database and report stages against synthetic data of increasing size, and saves the results as JSON
+which can be compared between commits. Run from the repository root, eg
+
+    python -m src.bench.benchmark run --sizes 1000 10000 100000
+    python -m src.bench.benchmark compare before.json after.json
+"""
+
+DEFAULT_SIZES = [1000, 10000, 100000]  # add 1000000 for the largest merged datasets; it takes some minutes
+
+
+def _clear_report_caches():
+    """ Forget statistics and leaderboards computed for earlier reports, so that every report is timed from scratch,
+    as it is on the first report of a run. Caches which do not exist in this tree are skipped. """
+    for module, cache_name, lock_name in [(author_stats, '_cache', '_cache_lock'),
+                                          (pandas_reports, '_leaderboards', '_leaderboards_lock')]:
+        cache = getattr(module, cache_name, None)
+        if cache is not None:
+            with getattr(module, lock_name, None) or contextlib.nullcontext():
+                cache.clear()
+
+
+def _parse_aliases(resolutions_path, aliases_path):
+    db = Database()
+    db.parse_resolutions(resolutions_path)
+    start = time.perf_counter()
+    db.parse_aliases(aliases_path)
+    return time.perf_counter() - start
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run_size(n, repeat=3, seed=0, directory='../db/cache/synthetic') -> dict:
+    """ Times each stage `repeat` times over `n` synthetic resolutions. Report stages run on a database which is
+    parsed once per repetition, each starting from empty report caches. """
+    resolutions_path, aliases_path = synthetic.ensure(n, directory=directory, seed=seed)
+    times = {}
+
+    def record(stage, seconds):
+        times.setdefault(stage, []).append(seconds)
+        print(f'{n:>9} {stage:<30} {seconds:8.3f} s')
+
+    db = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db = Database.create(resolutions_path, aliases_path)
+        record('Database.create', time.perf_counter() - start)
+        record('parse_aliases', _parse_aliases(resolutions_path, aliases_path))
+
+        # each report is timed with the caches it shares with the others cleared, so it includes the statistics pass
+        for stage, fn, args, kwargs in [('generate_author_table', generate_author_table, (db, OrderType.TOTAL), {}),
+                                        ('generate_author_index', generate_author_index, (db,), {}),
+                                        ('create_leaderboards', create_leaderboards, (db,), {'how': 'markdown'})]:
+            _clear_report_caches()
+            record(stage, _timed(fn, *args, **kwargs))
+
+    return {'resolutions': len(db.resolutions), 'authors': len(db.authors), 'players': len(db.player_authors),
+            'stages': {stage: {'min': min(t), 'median': statistics.median(t), 'times': t}
+                       for stage, t in times.items()}}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=None, repeat=3, seed=0, output_path=None) -> dict:
+    """ Runs every stage at each of `sizes` and saves the results to `output_path`, by default a file in
+    ../db/cache/bench named for the commit and time. Returns the results. """
+    results = {'commit': _commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'platform': platform.platform(), 'repeat': repeat, 'seed': seed,
+               'sizes': {}}
+    for n in sizes or DEFAULT_SIZES:
+        results['sizes'][str(n)] = run_size(n, repeat=repeat, seed=seed)
+
+    if output_path is None:
+        os.makedirs('../db/cache/bench', exist_ok=True)
+        output_path = '../db/cache/bench/bench_{}_{}.json'.format(
+            results['commit'] or 'unknown', datetime.now().strftime('%Y-%m-%d_%H%M%S'))
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f'saved results to {output_path}')
+    return results
+
+
+def compare(before_path, after_path):
+    """ Prints the best time for each stage and size in two saved results, and how much faster the second is """
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f'{"size":>9} {"stage":<30} {before["commit"] or "before":>10} {after["commit"] or "after":>10} speed-up')
+    for n, result in after['sizes'].items():
+        for stage, timing in result['stages'].items():
+            old = before['sizes'].get(n, {}).get('stages', {}).get(stage)
+            if old is None:
+                print(f'{n:>9} {stage:<30} {"-":>10} {timing["min"]:10.3f}')
+            else:
+                print(f'{n:>9} {stage:<30} {old["min"]:10.3f} {timing["min"]:10.3f} {old["min"] / timing["min"]:7.2f}x')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the database and reports on synthetic data.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='time every stage and save the results')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of resolutions')
+    run_parser.add_argument('--repeat', type=int, default=3, help='times to run each stage; the best is compared')
+    run_parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic data')
+    run_parser.add_argument('--output', help='results file; default in db/cache/bench')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two saved results')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    args = parser.parse_args()
+
+    # paths are relative to src, wherever we were run from. resolve given paths first
+    if args.command == 'run':
+        output = os.path.abspath(args.output) if args.output else None
+        os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        run(args.sizes, repeat=args.repeat, seed=args.seed, output_path=output)
+    else:
+        compare(args.before, args.after)
@@ -0,0 +1,88 @@
+# Copyright (c) 2020 ifly6
+import argparse
+import html
+import json
+import os
+import time
+
+from src import wa_cacher
+from src.coauthors import extract_all
+from src.wa_parser import read_resolution_xml
+
+""" Regression corpus for co-author extraction. `build` saves the text of every cached resolution with the co-authors
+currently extracted from it; `check` re-extracts them, lists any which have changed, and times the extractor. Run from
+the repository root, eg
+
+    python -m src.bench.coauthor_corpus build
+    python -m src.bench.coauthor_corpus check
+"""
+
+DEFAULT_PATH = '../db/cache/coauthor_corpus.json'
+
+
+def cached_texts(backend=None) -> dict:
+    """ Resolution texts in the API cache, keyed by url, unescaped as they are when parsed """
+    texts = {}
+    with wa_cacher.open_cache(backend) as cacher:
+        for url in sorted(cacher.keys()):
+            if 'q=resolution' not in url:
+                continue
+
+            record = read_resolution_xml(cacher.get(url))
+            if record is not None and record.desc is not None:
+                texts[url] = html.unescape(record.desc)
+    return texts
+
+
+def build(path=DEFAULT_PATH, backend=None) -> int:
+    """ Saves the corpus to `path`, returning how many texts it holds """
+    texts = cached_texts(backend)
+    coauthors = extract_all(texts.values())
+    corpus = [{'url': url, 'text': text, 'coauthors': c} for (url, text), c in zip(texts.items(), coauthors)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=1)
+
+    print(f'saved {len(corpus)} texts, {sum(1 for c in coauthors if c)} with co-authors, to {path}')
+    return len(corpus)
+
+
+def check(path=DEFAULT_PATH, repeat=5) -> list:
+    """ Re-extracts co-authors from the corpus at `path`, printing the texts whose co-authors have changed and the best
+    time over `repeat` runs. Returns the urls which changed. """
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+
+    texts = [entry['text'] for entry in corpus]
+    changed = []
+    for entry, coauthors in zip(corpus, extract_all(texts)):
+        if coauthors != entry['coauthors']:
+            changed.append(entry['url'])
+            print(f'{entry["url"]}: was {entry["coauthors"]}, now {coauthors}')
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        extract_all(texts)
+        best = min(best, time.perf_counter() - start)
+
+    print(f'{len(changed)} of {len(corpus)} texts changed; extracted all in {best:.4f} s '
+          f'({best / max(len(corpus), 1) * 1e6:.1f} us/text, best of {repeat})')
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or check the co-author extraction corpus.')
+    parser.add_argument('command', choices=['build', 'check'])
+    parser.add_argument('--path', help=f'corpus file; default {DEFAULT_PATH} from src')
+    parser.add_argument('--backend', help='cache backend to build from, of json, sqlite, journal; default sqlite')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.path) if args.path else None
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # cache paths are relative to src
+    if args.command == 'build':
+        build(path or DEFAULT_PATH, backend=args.backend)
+    else:
+        changed = check(path or DEFAULT_PATH, repeat=args.repeat)
+        if changed:
+            raise SystemExit(1)
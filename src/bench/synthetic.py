@@ -0,0 +1,145 @@
+# Copyright (c) 2020 ifly6
+import argparse
+import bisect
+import csv
+import itertools
+import os
+import random
+from datetime import datetime, timedelta
+
+""" Writes synthetic resolutions and aliases files in the same format as those in db, for measuring how the database
+and reports scale beyond the real few hundred resolutions. Nothing here reads the real data. """
+
+# the most common category and sub-category pairs in the real database, roughly in proportion
+CATEGORIES = [('Civil Rights', 'Significant', 72), ('Civil Rights', 'Mild', 38),
+              ('Environmental', 'All Businesses - Strong', 30), ('International Security', 'Mild', 29),
+              ('Education and Creativity', 'Educational', 28), ('Free Trade', 'Mild', 24),
+              ('Civil Rights', 'Strong', 18), ('Social Justice', 'Mild', 15), ('Health', 'Healthcare', 14),
+              ('Social Justice', 'Significant', 14), ('Global Disarmament', 'Mild', 9),
+              ('Furtherment of Democracy', 'Significant', 9), ('Regulation', 'Consumer Protection', 7),
+              ('Moral Decency', 'Mild', 7), ('Political Stability', 'Mild', 5)]
+
+_SYLLABLES = ['ar', 'ba', 'ce', 'do', 'el', 'fi', 'gu', 'ha', 'in', 'jo', 'ka', 'lu', 'me', 'no', 'or', 'pa', 'qui',
+              'ra', 'su', 'ta', 'un', 'vi', 'we', 'xa', 'yo', 'ze']
+_FORMS = ['', '', '', 'The Republic of ', 'Kingdom of ', 'The Federation of ', 'United ', 'New ', 'Holy Empire of ']
+_START = datetime(2008, 4, 6, 13)
+_END = datetime(2023, 4, 1, 13)
+
+
+def nation_name(i) -> str:
+    """ A unique, pronounceable nation name for each non-negative `i` """
+    syllables = []
+    while True:
+        i, digit = divmod(i, len(_SYLLABLES))
+        syllables.append(_SYLLABLES[digit])
+        if i == 0:
+            break
+        i -= 1  # so that eg 'ar' and 'arar' are both reachable, rather than leading 'ar's being dropped
+
+    return _FORMS[len(syllables) * 7 % len(_FORMS)] + ''.join(syllables).capitalize()
+
+
+def generate(resolutions_path, aliases_path, n, authors=None, author_skew=1.0, coauthor_weights=(70, 20, 7, 3),
+             repeal_rate=0.12, player_share=0.2, aliases_per_player=3, case_noise=0.05, seed=0):
+    """ Writes `n` synthetic resolutions to `resolutions_path` and their players' aliases to `aliases_path`.
+
+    Resolutions are written by `authors` nations (default `n // 4`), chosen with Zipf weights of exponent
+    `author_skew`, so a few nations write most of them. The number of co-authors on each resolution is drawn from
+    `coauthor_weights`, where the i-th weight is for i co-authors. A share `repeal_rate` of resolutions are repeals,
+    each of an earlier resolution which is not a repeal and not already repealed. A share `player_share` of nations
+    are grouped into players, each with on average `aliases_per_player` aliases. A share `case_noise` of names are
+    written in capitals, as some are in the real data. Output is the same for the same arguments. """
+    r = random.Random(seed)
+    authors = max(authors or n // 4, 2 + len(coauthor_weights))
+    names = [nation_name(i) for i in range(authors)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** author_skew for rank in range(authors)))
+    total_weight = cum_weights[-1]
+
+    def pick_nation():
+        return bisect.bisect(cum_weights, r.random() * total_weight)
+
+    def written(i):
+        return names[i].upper() if r.random() < case_noise else names[i]
+
+    categories = [(c, s) for c, s, _ in CATEGORIES]
+    category_weights = list(itertools.accumulate(w for _, _, w in CATEGORIES))
+    step = (_END - _START) / max(n, 1)
+    repealable = []  # numbers of resolutions which can still be repealed
+
+    with open(resolutions_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Number', 'Title', 'Category', 'Sub-category', 'Author', 'Co-authors', 'Votes For',
+                         'Votes Against', 'Date Implemented'])
+        for number in range(1, n + 1):
+            if repealable and r.random() < repeal_rate:
+                # swap the target with the last candidate, so it can be removed in constant time
+                j = r.randrange(len(repealable))
+                repealable[j], repealable[-1] = repealable[-1], repealable[j]
+                target = repealable.pop()
+                category, subcategory, title = 'Repeal', str(target), f'Repeal "Synthetic Resolution {target}"'
+            else:
+                category, subcategory = r.choices(categories, cum_weights=category_weights)[0]
+                title = f'Synthetic Resolution {number}'
+                repealable.append(number)
+
+            author = pick_nation()
+            coauthor_count = r.choices(range(len(coauthor_weights)), weights=coauthor_weights)[0]
+            coauthors = []
+            while len(coauthors) < coauthor_count:
+                i = pick_nation()
+                if i != author and i not in coauthors:
+                    coauthors.append(i)
+
+            votes_for = r.randint(3000, 15000)
+            date = _START + step * (number - 1) + timedelta(seconds=r.randint(0, 5))
+            writer.writerow([number, title, category, subcategory, written(author),
+                             ', '.join(written(i) for i in coauthors), votes_for, r.randint(500, votes_for),
+                             date.strftime('%Y-%m-%d %H:%M:%S') + '-04:00'])
+
+    # players take disjoint groups of nations; the first nation in each group is the player's main name
+    nations = list(range(authors))
+    r.shuffle(nations)
+    nations = nations[:int(authors * player_share)]
+    with open(aliases_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Player', 'Aliases'])
+        while len(nations) > 1:
+            group_size = 1 + r.randint(1, max(1, 2 * aliases_per_player - 1))
+            group, nations = nations[:group_size], nations[group_size:]
+            if len(group) > 1:
+                writer.writerow([names[group[0]], ','.join(names[i] for i in group[1:])])
+
+
+def ensure(n, directory='../db/cache/synthetic', seed=0, **kwargs):
+    """ Paths to synthetic resolutions and aliases files of `n` resolutions in `directory`, generated if they do not
+    already exist. Files are named by size and seed only, so delete them after changing other arguments. """
+    os.makedirs(directory, exist_ok=True)
+    resolutions_path = os.path.join(directory, f'resolutions_{n}_{seed}.csv')
+    aliases_path = os.path.join(directory, f'aliases_{n}_{seed}.csv')
+    if not (os.path.exists(resolutions_path) and os.path.exists(aliases_path)):
+        print(f'generating {n} synthetic resolutions')
+        generate(resolutions_path, aliases_path, n, seed=seed, **kwargs)
+    return resolutions_path, aliases_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic resolutions and aliases files.')
+    parser.add_argument('n', type=int, help='number of resolutions')
+    parser.add_argument('--resolutions', default='resolutions_synthetic.csv', help='resolutions file to write')
+    parser.add_argument('--aliases', default='aliases_synthetic.csv', help='aliases file to write')
+    parser.add_argument('--authors', type=int, help='number of nations writing resolutions; default n / 4')
+    parser.add_argument('--author-skew', type=float, default=1.0,
+                        help='Zipf exponent for how often each nation writes; 0 is uniform')
+    parser.add_argument('--coauthor-weights', default='70,20,7,3',
+                        help='relative weights of 0, 1, 2, ... co-authors on a resolution')
+    parser.add_argument('--repeal-rate', type=float, default=0.12, help='share of resolutions which are repeals')
+    parser.add_argument('--player-share', type=float, default=0.2, help='share of nations which belong to players')
+    parser.add_argument('--aliases-per-player', type=int, default=3, help='mean aliases per player')
+    parser.add_argument('--case-noise', type=float, default=0.05, help='share of names written in capitals')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.resolutions, args.aliases, args.n, authors=args.authors, author_skew=args.author_skew,
+             coauthor_weights=[float(w) for w in args.coauthor_weights.split(',')], repeal_rate=args.repeal_rate,
+             player_share=args.player_share, aliases_per_player=args.aliases_per_player,
+             case_noise=args.case_noise, seed=args.seed)
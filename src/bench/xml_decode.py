@@ -0,0 +1,91 @@
+# Copyright (c) 2020 ifly6
+import argparse
+import io
+import os
+import time
+
+from lxml import etree
+
+from src import wa_cacher
+from src.wa_parser import ResolutionXml, read_resolution_xml
+
+""" Times decoding every cached resolution response, comparing the single pass `read_resolution_xml`, on text and on
+bytes, against the separate absolute XPath lookups it replaced. Run from the repository root, eg
+
+    python -m src.bench.xml_decode --backend sqlite
+"""
+
+
+def read_with_xpaths(response: str):
+    """ The former decoder, one absolute XPath per field over a tree parsed through `io.StringIO` """
+    xml = etree.parse(io.StringIO(response))
+    if not xml.xpath('/WA/RESOLUTION/NAME'):
+        return None
+
+    is_repealed = xml.xpath('/WA/RESOLUTION/REPEALED_BY') != []
+    is_repeal = xml.xpath('/WA/RESOLUTION/REPEALS_COUNCILID') != []
+    return ResolutionXml(
+        name=xml.xpath('/WA/RESOLUTION/NAME')[0].text,
+        category=xml.xpath('/WA/RESOLUTION/CATEGORY')[0].text,
+        option=xml.xpath('/WA/RESOLUTION/OPTION')[0].text,
+        council=xml.xpath('/WA/RESOLUTION/COUNCIL')[0].text,
+        implemented=int(xml.xpath('/WA/RESOLUTION/IMPLEMENTED')[0].text),
+        proposed_by=xml.xpath('/WA/RESOLUTION/PROPOSED_BY')[0].text,
+        desc=xml.xpath('/WA/RESOLUTION/DESC')[0].text,
+        votes_for=int(xml.xpath('/WA/RESOLUTION/TOTAL_VOTES_FOR')[0].text),
+        votes_against=int(xml.xpath('/WA/RESOLUTION/TOTAL_VOTES_AGAINST')[0].text),
+        repealed_by=int(xml.xpath('/WA/RESOLUTION/REPEALED_BY')[0].text) if is_repealed else None,
+        repeals=int(xml.xpath('/WA/RESOLUTION/REPEALS_COUNCILID')[0].text) if is_repeal else None,
+        coauthors=tuple(n.text for n in xml.xpath('/WA/RESOLUTION/COAUTHOR/N'))
+    )
+
+
+def load_corpus(backend=None):
+    """ Every cached resolution response, as text """
+    with wa_cacher.open_cache(backend) as cacher:
+        return [cacher.get(k) for k in sorted(cacher.keys()) if 'q=resolution' in k]
+
+
+def run(corpus, repeat=5) -> dict:
+    """ Best time over `repeat` runs for each decoder to read the whole `corpus`. Raises `ValueError` if the decoders
+    disagree on any response. """
+    corpus_bytes = [r.encode('utf-8') for r in corpus]
+    decoders = {'xpath (str)': (read_with_xpaths, corpus),
+                'single pass (str)': (read_resolution_xml, corpus),
+                'single pass (bytes)': (read_resolution_xml, corpus_bytes)}
+
+    expected = [read_with_xpaths(r) for r in corpus]
+    for name, (decode, responses) in decoders.items():
+        if [decode(r) for r in responses] != expected:
+            raise ValueError(f'decoder {name} output invalid; differs from xpath decoder')
+
+    results = {}
+    for name, (decode, responses) in decoders.items():
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for r in responses:
+                decode(r)
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+
+    baseline = results['xpath (str)']
+    print(f'{len(corpus)} responses, {sum(map(len, corpus_bytes)):,} bytes; best of {repeat}')
+    for name, seconds in results.items():
+        print(f'{name:<20} {seconds:8.4f} s {seconds / max(len(corpus), 1) * 1e6:8.1f} us/response '
+              f'{baseline / seconds:6.2f}x')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark decoding cached resolution responses.')
+    parser.add_argument('--backend', help='cache backend to read, of json, sqlite, journal; default sqlite')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # cache paths are relative to src
+    responses = load_corpus(args.backend)
+    if not responses:
+        print('no cached resolutions; run the fetch stage first')
+    else:
+        run(responses, repeat=args.repeat)
@@ -0,0 +1,54 @@
+# Copyright (c) 2020 ifly6
+import re
+from functools import lru_cache
+
+from src.load_db import normalise_name
+
+
+class Capitaliser:
+    """ Capitalises nation names, categories, etc from the API, which come lower case with underscores. Names in
+    `exceptions` (eg from names.txt) are returned as written there if they match ignoring case; other strings have
+    their words capitalised, except short words and conjunctions after the first, with Roman numerals and 'WA'
+    upper-cased.
+
+    Results are memoised in an LRU cache of `maxsize` strings; the same names come up on many resolutions. """
+
+    _SMALL_WORDS = frozenset(['for', 'and', 'nor', 'but', 'yet', 'the'])  # fanboys & the
+    _NUMERAL = re.compile(r'(?<=\s)(?:ii|iii|iv|v|vi|vii|viii|ix|x)$')  # matches only trailing numerals
+    _WA_BETWEEN = re.compile(r'(?<=\s)(?:Wa|wa|wA)(?=\s)')  # WA missions; if between two spaces
+    _WA_START = re.compile(r'^(?:Wa|wa|wA)(?=\s)')  # if at start (eg WA Mission of NERV-UN)
+
+    def __init__(self, exceptions=(), maxsize=4096):
+        self.exceptions = {}
+        for name in exceptions:
+            self.exceptions.setdefault(normalise_name(name), name.strip())  # first spelling wins
+
+        self.capitalise = lru_cache(maxsize=maxsize)(self._capitalise)
+
+    def _capitalise(self, s: str) -> str:
+        s = s.replace('_', ' ').strip()
+
+        # replace with manual correction
+        exception = self.exceptions.get(s.lower())
+        if exception is not None:
+            return exception
+
+        # only capitalise words longer than 2 letters ('new') and always capitalise first, unless the word is in given
+        # list. python str.capitalize forces all other chars to lower ("Christian DeMocrats")
+        words = s.split()
+        for i, w in enumerate(words):
+            if (len(w) > 2 and w not in Capitaliser._SMALL_WORDS) or i == 0:
+                w = w.capitalize()
+            if w.lower() == 'st':  # but capitalise st -> St
+                w = 'St'
+            words[i] = w
+        s = ' '.join(words)
+
+        s = Capitaliser._NUMERAL.sub(lambda m: m.group(0).upper(), s)
+        s = Capitaliser._WA_BETWEEN.sub('WA', s)
+        return Capitaliser._WA_START.sub('WA', s)
+
+    def capitalise_all(self, values) -> list:
+        """ Capitalises every string in `values`, eg a data frame column, working out each distinct string once """
+        results = {}
+        return [results[v] if v in results else results.setdefault(v, self.capitalise(v)) for v in values]
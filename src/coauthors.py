@@ -0,0 +1,72 @@
+# Copyright (c) 2020 ifly6
+import re
+from typing import List, Optional
+
+from src.helpers import ref
+
+""" Finds co-authors named in the text of a resolution, for resolutions from before the API listed them. The first
+line of the text which looks like a co-author credit is taken, eg "Co-authored by: [nation]Bananaistan[/nation]", and
+the names in it are returned as reference names. """
+
+_TAGS = re.compile(r'\[/?[ibu]\]')  # italic, bold, underline
+_CREDIT = re.compile(r'(?=[ct])(?:co-?(?:author|writ(?:ten|er))|'
+                     r'this resolution includes significant contributions made by\s)', re.IGNORECASE)
+_COAUTHOR_LEAD = re.compile(r'Co-?((Author(ed)?:?)|written|writer) ?(by|with)? ?:? ', re.IGNORECASE)
+_NATION_PARAMETER = re.compile(r'(?<=\[nation)=(.*?)(?=\])')  # eg [nation=noflag]
+_NATION_TAG = re.compile(r'(?<=\[nation\])(.*?)(?=\[/nation\])')
+_SEPARATORS = re.compile(r'(,? and )|(, )')
+_LINE_BREAKS = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'  # as str.splitlines
+_LINE_BREAK = re.compile(f'[{_LINE_BREAKS}]')
+
+
+def strip_tags(s: str) -> str:
+    """ Removes italic, bold, and underline tags in one pass """
+    return _TAGS.sub('', s)
+
+
+def find_coauthor_line(text: str) -> Optional[str]:
+    """ The first line of `text` crediting co-authors, with formatting and the credit itself ('Co-authored by') removed,
+    or `None` if there is no such line """
+    text = strip_tags(text)
+
+    # search the whole text, rather than line by line. a credit found in a line is found at the same place in the
+    # text, so the first line with a credit is the line holding the first match, unless that match runs into the next
+    # line ('made by' at the end of a line), when the search carries on from there
+    position = 0
+    while True:
+        match = _CREDIT.search(text, position)
+        if match is None:
+            return None
+
+        start = max(text.rfind(c, 0, match.start()) for c in _LINE_BREAKS) + 1
+        end = _LINE_BREAK.search(text, match.start())
+        line = text[start:end.start() if end else len(text)]
+        if _CREDIT.search(line):
+            return _COAUTHOR_LEAD.sub('', line)
+        position = end.end()  # there is a next line, as the match ran into it
+
+
+def split_coauthor_line(line: str) -> List[str]:
+    """ Reference names of the nations in a co-author line, from nation tags if there are any or else by splitting
+    on commas and 'and' """
+    if '[nation' in line.lower():  # scion used the [Nation] tag instead of lower case once
+        coauthors = _NATION_TAG.findall(_NATION_PARAMETER.sub('', line.lower()))
+
+    else:
+        # this will break with names like "Sch'tz and West Runk'land". nb that this has only ever split twice and kept
+        # the comma separators, which then become co-authors; the database was built that way
+        coauthors = _SEPARATORS.split(line, 2)
+        coauthors = [i for i in coauthors if i is not None and i.strip() != 'and']  # post facto patching...
+
+    return [ref(s).replace('.', '') for s in coauthors]  # cast to reference name
+
+
+def extract_coauthors(text: str) -> List[str]:
+    """ Reference names of the co-authors credited in a resolution's text, if any """
+    line = find_coauthor_line(text)
+    return [] if line is None else split_coauthor_line(line)
+
+
+def extract_all(texts) -> List[List[str]]:
+    """ `extract_coauthors` over every text in `texts`, eg all resolutions at once """
+    return [extract_coauthors(t) for t in texts]
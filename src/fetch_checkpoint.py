@@ -0,0 +1,203 @@
+# Copyright (c) 2020 ifly6
+import json
+import os
+import shutil
+import socket
+import time
+from datetime import datetime
+from json import JSONDecodeError
+from typing import Optional
+
+""" Progress of a full fetch, kept on disk so that a run which dies part way (an `ApiError`, a forum outage, Ctrl-C)
+starts again where it stopped rather than from GA 1. Resolution numbers are split into blocks of `block_size`; block 0
+is 1 to 100, block 1 is 101 to 200, and so on. The checkpoint directory holds
+
+    block_00000.jsonl   one JSON record per resolution fetched in the block, appended as each one is decoded
+    block_00000.claim   who is fetching the block, if anyone; created exclusively, so only one worker holds it
+    host_1234.worker    one for each worker using the checkpoint, so that the last one out deletes it
+
+A worker claims a block, fetches the numbers in it which have no record, and releases it. As claims are exclusive
+files, workers in separate processes fetch disjoint blocks. A block is done when every number in it, up to the newest
+resolution, has a record. Claims left behind by a worker which died are taken over once they go stale. """
+
+DEFAULT_DIRECTORY = '../db/cache/fetch_checkpoint'
+
+
+class FetchCheckpoint:
+    """ Claims blocks of resolution numbers and records the resolutions fetched in them. Records from every block on
+    disk are in `records`, keyed by number. Use as a context manager, so that claims are released even on Ctrl-C. """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, block_size=100, stale_after=300):
+        self.directory = directory
+        self.stale_after = stale_after  # seconds without a new record before a claim can be taken over
+        self.owner = {'host': socket.gethostname(), 'pid': os.getpid()}
+        self.records = {}
+        self.claimed = {}  # block -> records file open for appending
+
+        os.makedirs(directory, exist_ok=True)
+        settings_path = os.path.join(directory, 'checkpoint.json')
+        try:
+            with open(settings_path, 'r', encoding='utf-8') as f:
+                self.block_size = json.load(f)['block_size']  # blocks on disk keep their size
+        except FileNotFoundError:
+            self.block_size = block_size
+            with open(settings_path, 'w', encoding='utf-8') as f:
+                json.dump({'block_size': block_size}, f)
+
+        self.worker_path = os.path.join(directory, f'{self.owner["host"]}_{self.owner["pid"]}.worker')
+        with open(self.worker_path, 'w', encoding='utf-8') as f:
+            json.dump(self.owner, f)
+
+        self.reload()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _path(self, block, extension):
+        return os.path.join(self.directory, f'block_{block:05d}.{extension}')
+
+    def blocks(self, latest):
+        """ Blocks covering resolutions 1 to `latest` """
+        return range((latest - 1) // self.block_size + 1) if latest > 0 else range(0)
+
+    def numbers(self, block, latest):
+        """ Numbers in `block`, up to `latest` """
+        return range(block * self.block_size + 1, min((block + 1) * self.block_size, latest) + 1)
+
+    def pending(self, block, latest) -> list:
+        """ Numbers in `block`, up to `latest`, without a record """
+        return [i for i in self.numbers(block, latest) if i not in self.records]
+
+    def is_complete(self, latest) -> bool:
+        return all(i in self.records for i in range(1, latest + 1))
+
+    def _load_block(self, block):
+        """ Reads the records of `block` into `records`, skipping a line torn by a crash mid-write """
+        try:
+            with open(self._path(block, 'jsonl'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except JSONDecodeError:
+                        continue
+                    self.records[record['resolution_num']] = record
+        except FileNotFoundError:
+            pass
+
+    def reload(self):
+        """ Re-reads every block on disk, eg to pick up resolutions recorded by other workers """
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith('block_') and name.endswith('.jsonl'):
+                self._load_block(int(name[len('block_'):-len('.jsonl')]))
+
+    def _is_stale(self, block) -> bool:
+        """ Whether the claim on `block` was left by a worker which has died. A claim from a process on this machine
+        which no longer exists is stale at once; any other is stale once `stale_after` seconds pass with no new
+        record in the block. """
+        try:
+            with open(self._path(block, 'claim'), 'r', encoding='utf-8') as f:
+                owner = json.load(f)
+            last_active = max(os.path.getmtime(self._path(block, e)) for e in ['claim', 'jsonl']
+                              if os.path.exists(self._path(block, e)))
+        except (FileNotFoundError, JSONDecodeError, ValueError):
+            return False  # released, or being written; look again later
+
+        return not self._is_running(owner) or time.time() - last_active > self.stale_after
+
+    def _is_running(self, owner) -> bool:
+        """ Whether the worker `owner` may still be running. Only a process on this machine can be checked; others
+        are taken to be running. """
+        if owner.get('host') != self.owner['host'] or os.name != 'posix':
+            return True
+        try:
+            os.kill(owner['pid'], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # exists, under another user
+        return True
+
+    def _try_claim(self, block) -> bool:
+        claim_path = self._path(block, 'claim')
+        if os.path.exists(claim_path):
+            if not self._is_stale(block):
+                return False
+            try:  # only one worker can move the stale claim aside, so only one takes it over
+                os.replace(claim_path, f'{claim_path}.stale.{os.getpid()}')
+            except FileNotFoundError:
+                return False
+            os.remove(f'{claim_path}.stale.{os.getpid()}')
+            print(f'taking over stale claim on block {block}')
+
+        try:
+            with open(claim_path, 'x', encoding='utf-8') as f:
+                json.dump(dict(self.owner, claimed_at=datetime.now().isoformat(timespec='seconds')), f)
+        except FileExistsError:
+            return False
+        return True
+
+    def claim(self, latest) -> Optional[int]:
+        """ Claims the first block with resolutions up to `latest` still to fetch, returning it, or `None` if every
+        such block is done or held by another worker """
+        for block in self.blocks(latest):
+            if block in self.claimed or not self.pending(block, latest) or not self._try_claim(block):
+                continue
+
+            self._load_block(block)  # may have been finished by another worker since it was last read
+            if not self.pending(block, latest):
+                os.remove(self._path(block, 'claim'))
+                continue
+
+            # drop a line torn by a crash mid-write, so that new records start on a line of their own
+            records_path = self._path(block, 'jsonl')
+            if os.path.exists(records_path):
+                with open(records_path, 'rb+') as f:
+                    data = f.read()
+                    f.truncate(data.rfind(b'\n') + 1)
+
+            self.claimed[block] = open(records_path, 'a', encoding='utf-8')
+            return block
+        return None
+
+    def record(self, record: dict):
+        """ Saves a decoded resolution, as a dict with `resolution_num`, in the block claimed for it """
+        number = record['resolution_num']
+        block = (number - 1) // self.block_size
+        if block not in self.claimed:
+            raise ValueError(f'resolution {number} invalid; its block {block} is not claimed')
+
+        f = self.claimed[block]
+        f.write(json.dumps(record) + '\n')
+        f.flush()  # written as it comes, so a crash loses at most this line
+        self.records[number] = record
+
+    def release(self, block):
+        """ Gives up the claim on `block`, whether or not it is done """
+        f = self.claimed.pop(block)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.remove(self._path(block, 'claim'))
+
+    def close(self):
+        for block in list(self.claimed):
+            self.release(block)
+        if os.path.exists(self.worker_path):
+            os.remove(self.worker_path)
+
+    def clear(self):
+        """ Deletes the checkpoint, once the database it was for is written. Other workers may still be reading it,
+        in which case it is left for the last of them to delete. """
+        self.close()
+        for name in os.listdir(self.directory):
+            if name.endswith('.worker'):
+                try:
+                    with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                        if self._is_running(json.load(f)):
+                            return
+                except (FileNotFoundError, JSONDecodeError):
+                    continue
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -1,13 +1,88 @@
 # Copyright (c) 2020 ifly6
-def write_file(path, s, print_input=False):
-    if print_input: print(s)
+import filecmp
+import os
+
+from src import instrument
+
 
+def _output_path(path):
     if not path.endswith('.txt'):
         if not path.endswith('.md'):
             path = path + '.txt'
+    return path
+
+
+def write_file(path, s, print_input=False) -> bool:
+    """ Writes `s` to `path`, leaving the file untouched if it already holds exactly that. Returns whether the file
+    was written. """
+    if print_input: print(s)
+
+    path = _output_path(path)
+    try:
+        with open(path, 'r') as f:
+            if f.read() == s:
+                _count_write(path, False)
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
 
     with open(path, 'w') as f:
         f.write(s)
+    _count_write(path, True)
+    return True
+
+
+def write_file_stream(path, chunks, buffer_size=64 * 1024) -> bool:
+    """ Like `write_file`, but writes an iterable of strings as they are produced, through a buffer of `buffer_size`
+    bytes, so the whole output never has to be held in memory. Chunks go to a temporary file next to `path`, which
+    only replaces it if the contents differ. """
+    path = _output_path(path)
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', buffering=buffer_size) as f:
+            f.writelines(chunks)
+    except BaseException:  # eg a renderer failing part way; leave no partial output behind
+        os.remove(temp_path)
+        raise
+
+    return _replace_if_changed(temp_path, path)
+
+
+def write_bytes(path, b: bytes) -> bool:
+    """ Writes `b` to `path` unless the file already holds exactly those bytes. Returns whether the file was
+    written. """
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == b:
+                _count_write(path, False)
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, 'wb') as f:
+        f.write(b)
+    _count_write(path, True)
+    return True
+
+
+def _replace_if_changed(temp_path, path) -> bool:
+    if os.path.exists(path) and filecmp.cmp(temp_path, path, shallow=False):
+        os.remove(temp_path)
+        _count_write(path, False)
+        return False
+
+    os.replace(temp_path, path)
+    _count_write(path, True)
+    return True
+
+
+def _count_write(path, written):
+    if instrument.enabled:
+        if written:
+            instrument.count('output.files_written')
+            instrument.count('output.bytes_written', os.path.getsize(path))
+        else:
+            instrument.count('output.files_unchanged')
 
 
 def ref(s: str) -> str:
@@ -0,0 +1,119 @@
+# Copyright (c) 2020 ifly6
+import functools
+import json
+import threading
+import time
+from datetime import datetime
+
+""" Counters and timers for finding where a run spends its time. Recording is off until `enable` is called; until
+then every call returns after checking one flag. Eg
+
+    instrument.count('api.calls')
+    with instrument.timed('database.parse_aliases'):
+        ...
+    @instrument.timed('parse.capitalise')
+    def capitalise(s): ...
+
+Names are dotted, with the module area first. Sizes of text are counted in characters. Work done in other processes
+is not recorded. """
+
+enabled = False
+_lock = threading.Lock()
+_counters = {}
+_timers = {}  # name -> [calls, seconds]
+_started = None
+
+
+def enable(on=True):
+    """ Starts (or with `on` false, stops) recording. Counts from before are kept; see `reset` """
+    global enabled, _started
+    enabled = on
+    if on and _started is None:
+        _started = time.perf_counter()
+
+
+def reset():
+    global _started
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _started = time.perf_counter() if enabled else None
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def add_time(name, seconds):
+    if enabled:
+        with _lock:
+            timer = _timers.setdefault(name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+
+class timed:
+    """ Times a block, as `with timed(name):`, or every call to a function, as `@timed(name)`. Time on different
+    threads adds up, so timers can exceed the wall time of the run. """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.start is not None:
+            add_time(self.name, time.perf_counter() - self.start)
+            self.start = None
+
+    def __call__(self, fn):
+        name = self.name
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+
+        return wrapper
+
+
+def report() -> dict:
+    """ Everything recorded so far, as a dict which can be saved as JSON """
+    with _lock:
+        return {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'wall_time': time.perf_counter() - _started if _started is not None else 0.0,
+            'counters': dict(sorted(_counters.items())),
+            'timers': {k: {'calls': calls, 'seconds': seconds} for k, (calls, seconds) in sorted(_timers.items())}
+        }
+
+
+def save_report(path) -> dict:
+    r = report()
+    with open(path, 'w') as f:
+        json.dump(r, f, indent=2)
+    return r
+
+
+def summary(r=None) -> str:
+    """ Human readable table of `r`, or of everything recorded so far """
+    if r is None:
+        r = report()
+
+    lines = [f'run took {r["wall_time"]:.2f} s']
+    lines.extend(f'{name:<40} {t["seconds"]:9.3f} s {t["calls"]:>9} calls' for name, t in r['timers'].items())
+    lines.extend(f'{name:<40} {n:>11}' for name, n in r['counters'].items())
+    return '\n'.join(lines)
@@ -1,11 +1,29 @@
 # Copyright (c) 2017 Auralia
 # Modifications, copyright (c) 2020 ifly6
 import csv
+import gc
+import glob
+import hashlib
+import os
+import pickle
 from datetime import datetime
 
+from src import instrument
+
+_SNAPSHOT_VERSION = 2  # bump when the classes below change shape, so old snapshots are not loaded
+
+
+def latest_database(pattern='../db/resolutions*.csv'):
+    """ Path to the most recently created resolutions database """
+    return max(glob.glob(pattern), key=os.path.getctime)
+
+
+def normalise_name(s):
+    return s.lower().strip()
+
 
 def is_same_name(i, a):
-    return i.lower().strip() == a.lower().strip()
+    return normalise_name(i) == normalise_name(a)
 
 
 class Database:
@@ -14,22 +32,163 @@ class Database:
         self.authors = []
         self.player_authors = []
         self.aliases = {}
+        self.alias_conflicts = {}  # normalised alias -> players claiming it, found when parsing aliases
+
+        # lookups built as rows are parsed; the first resolution or author to claim a key keeps it
+        self.resolutions_by_number = {}
+        self.authors_by_name = {}  # keyed by normalise_name
 
     @staticmethod
-    def create(resolutions_path, aliases_path):
+    @instrument.timed('database.create')
+    def create(resolutions_path, aliases_path, snapshot_path=None):
+        """ Parses the database from CSV. If `snapshot_path` is given, a snapshot saved from the same resolutions and
+        aliases files is loaded instead, and a new snapshot is saved there if there is none or it is out of date. """
+        if snapshot_path is not None:
+            key = Database.snapshot_key(resolutions_path, aliases_path)
+            db = Database.load_snapshot(snapshot_path, key)
+            if db is not None:
+                return db
+
         db = Database()
         db.parse_resolutions(resolutions_path)
         db.parse_aliases(aliases_path)
+
+        if snapshot_path is not None:
+            db.save_snapshot(snapshot_path, key)
+        return db
+
+    def __getstate__(self):
+        """ Flattens the object graph into columns of resolution and author attributes which refer to each other by
+        index. Pickling the linked objects directly recurses once per link and overflows the stack on large
+        databases, and columns of plain values load much faster than one dict per object. """
+        authors = self.authors + self.player_authors
+        ids = {'resolution': {id(r): i for i, r in enumerate(self.resolutions)},
+               'author': {id(a): i for i, a in enumerate(authors)}}
+
+        def to_columns(objs, links, skip=()):
+            columns = {}
+            for k in (vars(objs[0]) if objs else {}):
+                if k in skip:
+                    continue
+                values = [getattr(o, k) for o in objs]
+                if k in links:
+                    object_ids = ids[links[k]]
+                    values = [[object_ids[id(i)] for i in v] if isinstance(v, list)
+                              else None if v is None else object_ids[id(v)]
+                              for v in values]
+                columns[k] = values
+            return columns
+
+        state = {k: v for k, v in vars(self).items()
+                 if k not in ['resolutions', 'authors', 'player_authors', 'resolutions_by_number', 'authors_by_name']}
+        state.update({
+            'resolutions': (len(self.resolutions), to_columns(self.resolutions, _RESOLUTION_LINKS, skip=['db'])),
+            'authors': (len(authors), to_columns(authors, _AUTHOR_LINKS)),
+            'player_author_count': len(self.player_authors),
+            'resolutions_by_number': {k: ids['resolution'][id(v)] for k, v in self.resolutions_by_number.items()},
+            'authors_by_name': {k: ids['author'][id(v)] for k, v in self.authors_by_name.items()}
+        })
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        objects = {'resolution': [Resolution.__new__(Resolution) for _ in range(state['resolutions'][0])],
+                   'author': [Author.__new__(Author) for _ in range(state['authors'][0])]}
+
+        def from_columns(objs, columns, links):
+            for k, values in columns.items():
+                if k in links:
+                    linked = objects[links[k]]
+                    values = [[linked[i] for i in v] if isinstance(v, list)
+                              else None if v is None else linked[v]
+                              for v in values]
+                for o, v in zip(objs, values):
+                    o.__dict__[k] = v
+
+        resolutions, authors = objects['resolution'], objects['author']
+        for r in resolutions:
+            r.db = self
+        from_columns(resolutions, state.pop('resolutions')[1], _RESOLUTION_LINKS)
+        from_columns(authors, state.pop('authors')[1], _AUTHOR_LINKS)
+
+        player_author_count = state.pop('player_author_count')
+        self.resolutions = resolutions
+        self.authors = authors[:len(authors) - player_author_count]
+        self.player_authors = authors[len(authors) - player_author_count:]
+        self.resolutions_by_number = {k: resolutions[i] for k, i in state.pop('resolutions_by_number').items()}
+        self.authors_by_name = {k: authors[i] for k, i in state.pop('authors_by_name').items()}
+        self.__dict__.update(state)
+
+    @staticmethod
+    def snapshot_key(resolutions_path, aliases_path):
+        """ Content hashes of the files a database is built from """
+
+        def file_hash(path):
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+
+        return _SNAPSHOT_VERSION, file_hash(resolutions_path), file_hash(aliases_path)
+
+    def save_snapshot(self, path, key):
+        """ Pickles the key of the files the database was built from, then the fully linked database itself, so that
+        the key can be checked without loading the database """
+        temp_path = path + '.tmp'
+        with instrument.timed('database.save_snapshot'), open(temp_path, 'wb') as f:
+            pickle.dump(tuple(key), f, protocol=5)
+            pickle.dump(self, f, protocol=5)
+            instrument.count('database.bytes_written', f.tell())
+        os.replace(temp_path, path)  # never leave a half written snapshot behind
+
+    @staticmethod
+    def load_snapshot(path, key=None):
+        """ Loads a pickled database, or returns `None` if there is no snapshot, it was built from other files, or it
+        cannot be loaded (eg it was saved by an older version of these classes) """
+        gc.disable()  # nothing loaded here is garbage; collecting while building the graph only slows it down
+        try:
+            with instrument.timed('database.load_snapshot'), open(path, 'rb') as f:
+                saved_key = pickle.load(f)
+                if key is not None and saved_key != tuple(key):
+                    return None
+                db = pickle.load(f)
+                instrument.count('database.bytes_read', f.tell())
+        except FileNotFoundError:
+            return None
+        except Exception as e:  # any snapshot which does not load is as good as none; the CSV is parsed instead
+            print(f'snapshot at {path} could not be loaded ({type(e).__name__}: {e}); parsing instead')
+            return None
+        finally:
+            gc.enable()
+
         return db
 
+    @instrument.timed('database.parse_resolutions')
     def parse_resolutions(self, path):
         with open(path) as csv_file:
             next(csv_file)
             csv_reader = csv.reader(csv_file)
             for row in csv_reader:
-                self.resolutions.append(Resolution(self, *row))
+                resolution = Resolution(self, *row)
+                self.resolutions.append(resolution)
+                self.resolutions_by_number.setdefault(resolution.number, resolution)
+
+        instrument.count('database.rows_parsed', len(self.resolutions))
+        instrument.count('database.bytes_read', os.path.getsize(path))
 
+    def get_or_create_author(self, name):
+        """ Finds the author with the same name, ignoring case and surrounding whitespace, or creates one """
+        key = normalise_name(name)
+        author = self.authors_by_name.get(key)
+        if author is None:
+            author = Author(name.strip())
+            self.authors.append(author)
+            self.authors_by_name[key] = author
+        return author
+
+    @instrument.timed('database.parse_aliases')
     def parse_aliases(self, path):
+        # create players and an index from each alias to every player claiming it, in file order
+        players = []
+        alias_index = {}
         with open(path) as csv_file:
             next(csv_file)
             csv_reader = csv.reader(csv_file)
@@ -42,21 +201,46 @@ class Database:
                 self.aliases[player_name] = aliases
 
                 player = Author(player_name, is_player=True)
+                for alias in aliases:
+                    alias_index.setdefault(normalise_name(alias), []).append(len(players))
+                players.append(player)
+
+        # one pass over the resolutions to construct alias data. an alias listed more than once counts more than once,
+        # and where several players match a resolution, they are attached in file order
+        self.alias_conflicts = {}
+        for res in self.resolutions:
+            author_key = normalise_name(res.author.name)
+            for i in alias_index.get(author_key, []):
+                players[i].authored_resolutions.append(res)
+                res.player_author = players[i]
+
+            # ^ case insensitive check; aliases matching the author are not also counted as co-authors
+            coauthor_keys = {normalise_name(r.name) for r in res.coauthors}
+            coauthor_matches = {}
+            for coauthor_key in coauthor_keys - {author_key}:
+                for i in alias_index.get(coauthor_key, []):
+                    coauthor_matches[i] = coauthor_matches.get(i, 0) + 1
+
+            for i in sorted(coauthor_matches):
+                for _ in range(coauthor_matches[i]):
+                    players[i].coauthored_resolutions.append(res)
+                    res.player_coauthors.append(players[i])
 
-                # for all resolutions, construct alias data
-                for res in self.resolutions:
-                    for alias in aliases:
-                        if is_same_name(alias, res.author.name):
-                            player.authored_resolutions.append(res)
-                            res.player_author = player
+            # an alias claimed by two players which has actually been used on a resolution
+            for key in coauthor_keys | {author_key}:
+                claimants = {players[i].name for i in alias_index.get(key, [])}
+                if len(claimants) > 1 and key not in self.alias_conflicts:
+                    self.alias_conflicts[key] = sorted(claimants)
+                    print(f'alias {key} is claimed by more than one player: {", ".join(sorted(claimants))}')
 
-                        elif any(is_same_name(alias, r.name) for r in res.coauthors):
-                            # ^ case insensitive check
-                            # OG: elif alias.lower() in [r.name.lower() for r in resolution.coauthors]:
-                            player.coauthored_resolutions.append(res)
-                            res.player_coauthors.append(player)
+        self.player_authors.extend(players)
+        instrument.count('database.alias_rows', len(players))
 
-                self.player_authors.append(player)
+
+# attributes holding other objects, flattened to indices in database snapshots
+_RESOLUTION_LINKS = {'repeal': 'resolution', 'repealed_by': 'resolution', 'author': 'author', 'coauthors': 'author',
+                     'player_author': 'author', 'player_coauthors': 'author'}
+_AUTHOR_LINKS = {'authored_resolutions': 'resolution', 'coauthored_resolutions': 'resolution'}
 
 
 class Author:
@@ -83,11 +267,10 @@ class Resolution:
 
         if self.category == "Repeal":
             repeal_number = int(self.subcategory)
-            for res in db.resolutions:
-                if res.number == int(self.subcategory):
-                    self.repeal = res
-                    res.repealed_by = self
-                    break
+            res = db.resolutions_by_number.get(repeal_number)
+            if res is not None:
+                self.repeal = res
+                res.repealed_by = self
 
             else:  # if no resolution was found
                 if int(self.number) < int(self.subcategory):
@@ -101,14 +284,7 @@ class Resolution:
             self.repeal = None
 
         # get or create authors
-        for a in db.authors:
-            if is_same_name(a.name, author_name):
-                self.author = a
-                break
-        else:
-            self.author = Author(author_name.strip())
-            db.authors.append(self.author)
-
+        self.author = db.get_or_create_author(author_name)
         self.author.authored_resolutions.append(self)
 
         # get or create co-authors
@@ -117,16 +293,8 @@ class Resolution:
             if coauthor_name == "":
                 continue
 
-            for a in db.authors:
-                if is_same_name(a.name, coauthor_name):
-                    coauthor = a
-                    self.coauthors.append(a)
-                    break
-            else:
-                coauthor = Author(coauthor_name)
-                self.coauthors.append(coauthor)
-                db.authors.append(coauthor)
-
+            coauthor = db.get_or_create_author(coauthor_name)
+            self.coauthors.append(coauthor)
             coauthor.coauthored_resolutions.append(self)
 
         self.votes_for = int(votes_for)
@@ -1,91 +1,208 @@
 # Copyright (c) 2017 Auralia
 # Modifications, copyright (c) 2020 ifly6
-import glob
+""" Updates the database and writes the reports. Run as a module from the repository root, eg
+
+    python -m src.main                       # every stage
+    python -m src.main bbcode                # only the bbCode tables, without fetching
+    python -m src.main fetch --full          # rebuild the database from GA 1; resumes if interrupted
+    python -m src.main fetch --from-cache    # rebuild it from cached responses, without the API
+
+Stages are fetch (poll the API for new resolutions), parse (load the database), leaderboards (markdown tables),
+charts (leaderboard chart) and bbcode (old bbCode tables). The report stages parse the database first. Each stage
+only imports what it needs, so that eg the bbCode tables don't wait on matplotlib. """
+import argparse
+import importlib
 import os
+import time
 from datetime import datetime
-from os.path import exists
-
-import pandas as pd
-import seaborn as sns
-from matplotlib import pyplot as plt
-from matplotlib.ticker import MultipleLocator, AutoMinorLocator
-
-from src import wa_parser
-from src.helpers import write_file
-from src.reports.bbcode_reports import *
-from src.reports.pandas_reports import create_leaderboards, create_aliases
-
-print('starting')
-updating_database = True
-writing_files = True
-
-# ensure folders for relevant directories exist
-for p in ['../output', '../md_output', '../db', '../db/cache']:
-    os.makedirs(p, exist_ok=True)
-
-for p in ['../db/aliases.csv', '../db/names.txt']:
-    if not exists(p):
-        raise FileNotFoundError(f'file {p} must exist')
-
-if updating_database:
-    print('updating database')
-    df_path = '../db/resolutions_{}.csv'.format(pd.Timestamp.now().strftime('%Y-%m-%d'))
-    df = wa_parser.parse()
+
+from src import instrument
+
+_start = time.perf_counter()
+
+STAGES = ['fetch', 'parse', 'leaderboards', 'charts', 'bbcode']
+REPORT_STAGES = ['leaderboards', 'charts', 'bbcode']
+_STAGE_MODULES = {
+    'fetch': ['src.wa_parser'],
+    'parse': ['src.load_db'],
+    'leaderboards': ['src.reports.pandas_reports'],
+    'charts': ['src.reports.charts'],
+    'bbcode': ['src.reports.bbcode_reports'],
+}
+
+
+def import_stage(stage) -> float:
+    """ Imports the modules used by `stage`, returning how long it took in seconds """
+    start = time.perf_counter()
+    for module in _STAGE_MODULES[stage]:
+        importlib.import_module(module)
+    return time.perf_counter() - start
+
+
+def fetch(full=False, from_cache=False) -> str:
+    """ Polls the API for resolutions newer than the latest database, or every resolution if `full`, and saves the
+    result to a dated CSV. Returns its path. If `from_cache`, the database is instead rebuilt from cached responses
+    without calling the API, and its differences from the latest database are printed. """
+    import pandas as pd
+    from src import wa_parser
+    from src.load_db import latest_database
+
+    df_path = '../db/resolutions_{}.csv'.format(datetime.now().strftime('%Y-%m-%d'))
+    if from_cache:
+        df = wa_parser.rebuild_from_cache()
+        base_path = latest_database()
+        diff = wa_parser.diff_databases(pd.read_csv(base_path, dtype=str, keep_default_na=False), df)
+        print(f'{len(diff)} differences from {base_path}' + (':\n' + diff.to_string(index=False) if len(diff) else ''))
+    else:
+        df = wa_parser.parse() if full else wa_parser.parse_incremental()
     df.to_csv(df_path, index=False)
+    return df_path
+
+
+def parse(resolutions_path=None):
+    """ Loads the database from `resolutions_path`, or the latest database. A snapshot is reused while the
+    resolutions and aliases files are unchanged. """
+    from src.load_db import Database, latest_database
+
+    if resolutions_path is None:
+        resolutions_path = latest_database()
+    return resolutions_path, Database.create(resolutions_path, '../db/aliases.csv',
+                                             snapshot_path='../db/cache/database.pickle')
+
+
+def leaderboard_tasks(inputs):
+    from src.reports.pandas_reports import create_aliases, create_leaderboards
+    from src.reports.pipeline import text_task
+
+    return [
+        text_task('markdown table', '../md_output/leaderboard.md', create_leaderboards, inputs=inputs,
+                  how='markdown', print_input=True),
+        text_task('markdown table no puppets', '../md_output/leaderboard-no-puppets.md', create_leaderboards,
+                  inputs=inputs, how='markdown', keep_puppets=False, print_input=True),
+        text_task('alias table', '../md_output/aliases.md', lambda _: create_aliases(), inputs=['../db/aliases.csv'],
+                  print_input=True)
+    ]
+
+
+def chart_tasks(inputs):
+    from src.reports.charts import create_leaderboard_chart
+    from src.reports.pipeline import ReportTask
+
+    chart_paths = ['../md_output/leaderboard_top30.pdf', '../md_output/leaderboard_top30.jpg']
+    return [ReportTask('leaderboard chart', create_leaderboard_chart, chart_paths, inputs=inputs, outputs=chart_paths)]
+
+
+def bbcode_tasks(inputs):
+    from src.reports.bbcode_reports import OrderType, iter_author_index, iter_author_table, iter_known_aliases
+    from src.reports.pipeline import stream_task
+
+    return [
+        stream_task('author index', '../output/author_index', iter_author_index, inputs=inputs),
+        stream_task('table AUTHOR', '../output/table_AUTHOR', iter_author_table, OrderType.AUTHOR, inputs=inputs),
+        stream_task('table LEADERBOARDS', '../output/table_LEADERBOARDS', iter_author_table, OrderType.TOTAL,
+                    inputs=inputs),
+        stream_task('table ACTIVE_TOTAL', '../output/table_ACTIVE_TOTAL', iter_author_table, OrderType.ACTIVE_TOTAL,
+                    inputs=inputs),
+        stream_task('table NON_REPEALS', '../output/table_NON_REPEALS', iter_author_table,
+                    OrderType.ACTIVE_NON_REPEALS_TOTAL, inputs=inputs),
+        stream_task('table REPEALS', '../output/table_REPEALS', iter_author_table, OrderType.ACTIVE_REPEALS_TOTAL,
+                    inputs=inputs),
+        stream_task('table REPEALED', '../output/table_REPEALED', iter_author_table, OrderType.REPEALED_TOTAL,
+                    inputs=inputs),
+        stream_task('author aliases', '../output/author_aliases', iter_known_aliases, inputs=inputs)
+    ]
+
+
+_STAGE_TASKS = {'charts': chart_tasks, 'leaderboards': leaderboard_tasks, 'bbcode': bbcode_tasks}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.main', description='Update the database and write reports.')
+    parser.add_argument('stages', nargs='*', metavar='stage',
+                        help=f'stages to run, of {", ".join(STAGES)}; default all')
+    parser.add_argument('--full', action='store_true',
+                        help='fetch every resolution from GA 1, rather than only those newer than the latest database')
+    parser.add_argument('--from-cache', action='store_true',
+                        help='rebuild the database from cached API responses, without fetching, and show what changed')
+    parser.add_argument('--resolutions', help='resolutions CSV to report on; default the latest database')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='write every report, even if its inputs are unchanged since the last run')
+    parser.add_argument('--workers', type=int, default=4, help='reports are written on a thread pool of this size')
+    parser.add_argument('--report', metavar='PATH',
+                        help='record timers and counters (api calls, cache hits, bytes, rows) and save them as JSON')
+    args = parser.parse_args(argv)
+    for stage in args.stages:
+        if stage not in STAGES:
+            parser.error(f'stage {stage} invalid; choose from {", ".join(STAGES)}')
+
+    stages = [s for s in STAGES if s in (args.stages or STAGES)]  # run in pipeline order, whatever order they were given
+    if any(s in REPORT_STAGES for s in stages) and 'parse' not in stages:
+        stages.insert(stages.index(next(s for s in stages if s in REPORT_STAGES)), 'parse')
+
+    report_path = os.path.abspath(args.report) if args.report else None
+    if args.resolutions:
+        args.resolutions = os.path.abspath(args.resolutions)  # given relative to where we were run from
+    if report_path is not None:
+        instrument.enable()
+
+    # paths are relative to src, wherever we were run from
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    for p in ['../output', '../md_output', '../db', '../db/cache']:
+        os.makedirs(p, exist_ok=True)
+
+    for p in ['../db/aliases.csv', '../db/names.txt']:
+        if not os.path.exists(p):
+            raise FileNotFoundError(f'file {p} must exist')
+
+    print(f'starting {", ".join(stages)}; started in {time.perf_counter() - _start:.2f} s')
+    import_times, run_times = {}, {}
+    resolutions_path, db = args.resolutions, None
+
+    if 'fetch' in stages:
+        print('updating database')
+        import_times['fetch'] = import_stage('fetch')
+        start = time.perf_counter()
+        path = fetch(full=args.full, from_cache=args.from_cache)
+        resolutions_path = resolutions_path or path
+        run_times['fetch'] = time.perf_counter() - start
+
+    if 'parse' in stages:
+        print('parsing database')
+        import_times['parse'] = import_stage('parse')
+        start = time.perf_counter()
+        resolutions_path, db = parse(resolutions_path)
+        run_times['parse'] = time.perf_counter() - start
+
+    # write reports; the chart is slowest, so it goes first to overlap with the text reports
+    report_stages = [s for s in stages if s in REPORT_STAGES]
+    for stage in report_stages:
+        import_times[stage] = import_stage(stage)
+
+    tasks, task_stages = [], {}
+    for stage in sorted(report_stages, key=list(_STAGE_TASKS).index):
+        for task in _STAGE_TASKS[stage]([resolutions_path, '../db/aliases.csv']):
+            tasks.append(task)
+            task_stages[task.name] = stage
+            run_times[stage] = 0
+
+    if tasks:
+        from src.reports.pipeline import BuildManifest, run_reports
+
+        print('writing reports')
+        timings = run_reports(db, tasks, workers=args.workers, manifest=BuildManifest(), force=args.rebuild)
+        for name, seconds in timings.items():
+            run_times[task_stages[name]] += seconds
+
+    for stage in stages:
+        print(f'{stage}: imported in {import_times[stage]:.2f} s, ran in {run_times[stage]:.2f} s')
+        instrument.add_time(f'stage.{stage}.import', import_times[stage])
+        instrument.add_time(f'stage.{stage}.run', run_times[stage])
+    print(f'finished in {time.perf_counter() - _start:.2f} s')
+
+    if report_path is not None:
+        print(instrument.summary(instrument.save_report(report_path)))
+        print(f'saved run report to {report_path}')
+
 
-# parse database
-print('parsing database')
-db = Database.create(max(glob.glob('../db/resolutions*.csv'), key=os.path.getctime), '../db/aliases.csv')
-# > uncomment below to generate for explicit path
-# db = Database.create('../db/resolutions.csv', '../db/aliases.csv')
-
-# create table
-print('creating markdown table')
-s = create_leaderboards(db, how='markdown')
-write_file('../md_output/leaderboard.md', s, print_input=True)
-
-print('creating markdown table no puppets')
-s = create_leaderboards(db, how='markdown', keep_puppets=False)
-write_file('../md_output/leaderboard-no-puppets.md', s, print_input=True)
-
-# create alias table
-print('creating alias table')
-s = create_aliases()
-write_file('../md_output/aliases.md', s, print_input=True)
-
-# create chart
-print('creating chart')
-ranks = create_leaderboards(db, how='pandas', keep_puppets=False)
-ranks['Name'] = ranks['Name'].str.replace(r'\[PLAYER\]', '', regex=True).str.strip()  # de-dup from players
-ranks.drop_duplicates(subset='Name', keep='first', inplace=True)
-ranks = ranks[ranks['Rank'] <= 30]
-
-f, ax = plt.subplots(figsize=(8.25, 11.71))
-ax.barh(ranks['Name'], ranks['Total'], color=sns.color_palette('muted'), zorder=2)
-ax.set_ylim([-1, ranks['Name'].size])
-ax.invert_yaxis()
-ax.xaxis.set_minor_locator(AutoMinorLocator())
-ax.xaxis.grid(True, linestyle='dashed', which='major', zorder=0)
-ax.xaxis.grid(True, linestyle='dotted', which='minor', zorder=0)
-ax.set_title('Players with most WA resolutions')
-ax.annotate(
-    'Data as of {}. See https://github.com/ifly6/WA-Authorboards.'.format(datetime.today().strftime('%Y-%m-%d')),
-    (0, 0), (0, -20), xycoords='axes fraction', textcoords='offset points', va='top'
-)
-
-f.tight_layout()
-f.savefig('../md_output/leaderboard_top30.pdf')
-f.savefig('../md_output/leaderboard_top30.jpg')
-print('wrote chart')
-
-# write old bbCode files
-if writing_files:
-    print('saving tables')
-    write_file('../output/author_index', generate_author_index(db))
-    write_file('../output/table_AUTHOR', generate_author_table(db, OrderType.AUTHOR))
-    write_file('../output/table_LEADERBOARDS', generate_author_table(db, OrderType.TOTAL))
-    write_file('../output/table_ACTIVE_TOTAL', generate_author_table(db, OrderType.ACTIVE_TOTAL))
-    write_file('../output/table_NON_REPEALS', generate_author_table(db, OrderType.ACTIVE_NON_REPEALS_TOTAL))
-    write_file('../output/table_REPEALS', generate_author_table(db, OrderType.ACTIVE_REPEALS_TOTAL))
-    write_file('../output/table_REPEALED', generate_author_table(db, OrderType.REPEALED_TOTAL))
-    write_file('../output/author_aliases', generate_known_aliases(db))
+if __name__ == '__main__':
+    main()
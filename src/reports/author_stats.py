@@ -0,0 +1,107 @@
+# Copyright (c) 2020 ifly6
+import threading
+import weakref
+
+import numpy as np
+
+from src import instrument
+from src.load_db import Database
+
+_cache = weakref.WeakKeyDictionary()
+_cache_lock = threading.Lock()  # reports on different threads share one computation
+
+
+class AuthorStats:
+    """ Resolution counts for every author and player in a database. Each author's resolutions are walked once and
+    every counter is filled in that pass, into an integer array with one row per author and one column per counter.
+    Orderings are then plain sorts over a column.
+
+    Buckets follow the bbCode author tables: 'author' is sole author, 'sub_coauthor' is submitting author of a
+    resolution with co-authors, and 'non_sub_coauthor' is a listed co-author. """
+
+    COLUMNS = [
+        # totals used for ordering
+        'total', 'authored', 'coauthored', 'active', 'active_non_repeals', 'active_repeals', 'repealed',
+
+        # author table buckets. nb that repeals count here whether or not they have themselves been repealed
+        'active_non_repeal_author', 'active_non_repeal_sub_coauthor', 'active_non_repeal_non_sub_coauthor',
+        'active_repeal_author', 'active_repeal_sub_coauthor', 'active_repeal_non_sub_coauthor',
+        'repealed_author', 'repealed_sub_coauthor', 'repealed_non_sub_coauthor',
+
+        # leaderboard counts, which go by category rather than by repeal link
+        'leaderboard_repeals', 'leaderboard_active'
+    ]
+
+    @instrument.timed('report.author_stats')
+    def __init__(self, db: Database):
+        self.authors = db.authors + db.player_authors
+        self.names = [a.name for a in self.authors]
+        self.columns = {c: i for i, c in enumerate(AuthorStats.COLUMNS)}
+        self.counts = np.zeros((len(self.authors), len(AuthorStats.COLUMNS)), dtype=np.int64)
+
+        for i, author in enumerate(self.authors):
+            row = self._count(author)
+            self.counts[i] = [row.get(c, 0) for c in AuthorStats.COLUMNS]
+
+    @staticmethod
+    def of(db: Database) -> 'AuthorStats':
+        """ Statistics for `db`, computed the first time they are asked for. Don't modify the database after. """
+        with _cache_lock:
+            stats = _cache.get(db)
+            if stats is None:
+                stats = AuthorStats(db)
+                _cache[db] = stats
+            return stats
+
+    @staticmethod
+    def _count(author):
+        row = {}
+
+        def add(column):
+            row[column] = row.get(column, 0) + 1
+
+        for as_coauthor, resolutions in [(False, author.authored_resolutions), (True, author.coauthored_resolutions)]:
+            for r in resolutions:
+                is_repealed = r.repealed_by is not None
+                is_repeal = r.repeal is not None
+                bucket = 'non_sub_coauthor' if as_coauthor else 'sub_coauthor' if r.coauthors else 'author'
+
+                add('total')
+                add('coauthored' if as_coauthor else 'authored')
+                if is_repealed:
+                    add('repealed')
+                    add(f'repealed_{bucket}')
+                else:
+                    add('active')
+                    add('active_repeals' if is_repeal else 'active_non_repeals')
+                    if not is_repeal:
+                        add(f'active_non_repeal_{bucket}')
+
+                if is_repeal:
+                    add(f'active_repeal_{bucket}')
+
+                is_repeal_category = r.category in ['Repeal', 'repeal']
+                if is_repeal_category and not as_coauthor:
+                    add('leaderboard_repeals')
+                if not is_repealed and not is_repeal_category:
+                    add('leaderboard_active')
+
+        return row
+
+    def __len__(self):
+        return len(self.authors)
+
+    def __getitem__(self, column) -> 'np.ndarray':
+        return self.counts[:, self.columns[column]]
+
+    def row(self, i) -> dict:
+        return dict(zip(AuthorStats.COLUMNS, self.counts[i].tolist()))
+
+    def order(self, column=None):
+        """ Author indices sorted by `column` descending, then by name. Without a column, by name alone. Ties keep
+        database order, with authors before players. """
+        if column is None:
+            return sorted(range(len(self)), key=lambda i: self.names[i])
+
+        counts = self[column].tolist()
+        return sorted(range(len(self)), key=lambda i: (-counts[i], self.names[i]))
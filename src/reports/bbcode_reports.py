@@ -3,6 +3,7 @@
 from enum import Enum
 
 from src.load_db import Database
+from src.reports.author_stats import AuthorStats
 
 
 class OrderType(Enum):
@@ -15,17 +16,21 @@ class OrderType(Enum):
 
 
 def generate_author_index(db: Database):
-    bbcode = ''
+    return ''.join(iter_author_index(db))
 
+
+def iter_author_index(db: Database):
+    """ Yields the author index in chunks, one per author """
     authors = db.authors[:]
     authors.extend(db.player_authors)
     authors.sort(key=lambda x: x.name)
 
-    anchors = []
+    anchors = set()
     for author in authors:
+        bbcode = ''
         if author.name[0] not in anchors:
             bbcode += f'[anchor=index-{author.name[0]}][/anchor]'
-            anchors.append(author.name[0])
+            anchors.add(author.name[0])
 
         if author.is_player:
             bbcode += f'[b][PLAYER] [nation]{author.name}[/nation][/b]\n'
@@ -51,57 +56,27 @@ def generate_author_index(db: Database):
             bbcode += f'[*]{entry}\n'
         bbcode += '[/list]\n\n'
 
-    return bbcode
+        yield bbcode
+
+
+# column of AuthorStats each table is ordered by; None orders by name
+_ORDER_COLUMNS = {
+    OrderType.AUTHOR: None,
+    OrderType.TOTAL: 'total',
+    OrderType.ACTIVE_TOTAL: 'active',
+    OrderType.ACTIVE_NON_REPEALS_TOTAL: 'active_non_repeals',
+    OrderType.ACTIVE_REPEALS_TOTAL: 'active_repeals',
+    OrderType.REPEALED_TOTAL: 'repealed'
+}
 
 
 def generate_author_table(db: Database, order_type: OrderType):
-    authors = db.authors[:]
-    authors.extend(db.player_authors)
+    return ''.join(iter_author_table(db, order_type))
+
 
-    if order_type == OrderType.AUTHOR:
-        authors.sort(key=lambda x: x.name)
-    elif order_type == OrderType.TOTAL:
-        authors.sort(key=lambda x: x.name)
-        authors.reverse()
-        authors.sort(key=lambda x: (len(x.authored_resolutions)
-                                    + len(x.coauthored_resolutions)))
-        authors.reverse()
-    elif order_type == OrderType.ACTIVE_TOTAL:
-        authors.sort(key=lambda x: x.name)
-        authors.reverse()
-        authors.sort(key=lambda x: (
-                len(list(filter(lambda y: not y.repealed_by,
-                                x.authored_resolutions)))
-                + len(list(filter(lambda y: not y.repealed_by,
-                                  x.coauthored_resolutions)))))
-        authors.reverse()
-    elif order_type == OrderType.ACTIVE_NON_REPEALS_TOTAL:
-        authors.sort(key=lambda x: x.name)
-        authors.reverse()
-        authors.sort(key=lambda x: (
-                len(list(filter(lambda y: not y.repealed_by and not y.repeal,
-                                x.authored_resolutions)))
-                + len(list(filter(lambda y: not y.repealed_by and not y.repeal,
-                                  x.coauthored_resolutions)))))
-        authors.reverse()
-    elif order_type == OrderType.ACTIVE_REPEALS_TOTAL:
-        authors.sort(key=lambda x: x.name)
-        authors.reverse()
-        authors.sort(key=lambda x: (
-                len(list(filter(lambda y: not y.repealed_by and y.repeal,
-                                x.authored_resolutions)))
-                + len(list(filter(lambda y: not y.repealed_by and y.repeal,
-                                  x.coauthored_resolutions)))))
-        authors.reverse()
-    elif order_type == OrderType.REPEALED_TOTAL:
-        authors.sort(key=lambda x: x.name)
-        authors.reverse()
-        authors.sort(key=lambda x: (
-                len(list(filter(lambda y: y.repealed_by,
-                                x.authored_resolutions)))
-                + len(list(filter(lambda y: y.repealed_by,
-                                  x.coauthored_resolutions)))))
-        authors.reverse()
+def iter_author_table(db: Database, order_type: OrderType):
+    """ Yields the author table in chunks: the header, then one per author row """
+    stats = AuthorStats.of(db)
 
     bbcode = '[table]'
 
@@ -159,91 +134,79 @@ def generate_author_table(db: Database, order_type: OrderType):
     bbcode += '[td][b][/b][/td]'
     bbcode += '[/tr]'
 
-    for author in authors:
-        bbcode += '[tr]'
+    yield bbcode
+
+    for i in stats.order(_ORDER_COLUMNS[order_type]):
+        author = stats.authors[i]
+        c = stats.row(i)
+
+        bbcode = '[tr]'
         if author.is_player:
             bbcode += f'[td][PLAYER] [nation]{author.name}[/nation][/td]'
         else:
             bbcode += f'[td][nation]{author.name}[/nation][/td]'
 
-        active_non_repeal_author = len(list(filter(
-            lambda y: not y.repealed_by and not y.coauthors and not y.repeal,
-            author.authored_resolutions)))
-        active_non_repeal_sub_coauthor = len(list(filter(
-            lambda y: not y.repealed_by and y.coauthors and not y.repeal,
-            author.authored_resolutions)))
-        active_non_repeal_non_sub_coauthor = len(list(filter(
-            lambda y: not y.repealed_by and not y.repeal,
-            author.coauthored_resolutions)))
-        active_non_repeal_total = (active_non_repeal_author
-                                   + active_non_repeal_sub_coauthor
-                                   + active_non_repeal_non_sub_coauthor)
-        bbcode += f'[td]{active_non_repeal_author}[/td]'
-        bbcode += f'[td]{active_non_repeal_sub_coauthor}[/td]'
-        bbcode += f'[td]{active_non_repeal_non_sub_coauthor}[/td]'
+        active_non_repeal_total = (c['active_non_repeal_author']
+                                   + c['active_non_repeal_sub_coauthor']
+                                   + c['active_non_repeal_non_sub_coauthor'])
+        bbcode += f'[td]{c["active_non_repeal_author"]}[/td]'
+        bbcode += f'[td]{c["active_non_repeal_sub_coauthor"]}[/td]'
+        bbcode += f'[td]{c["active_non_repeal_non_sub_coauthor"]}[/td]'
         bbcode += f'[td]{active_non_repeal_total}[/td]'
 
-        active_repeal_author = len(list(filter(
-            lambda y: not y.coauthors and y.repeal,
-            author.authored_resolutions)))
-        active_repeal_sub_coauthor = len(list(filter(
-            lambda y: y.coauthors and y.repeal,
-            author.authored_resolutions)))
-        active_repeal_non_sub_coauthor = len(list(filter(
-            lambda y: y.repeal,
-            author.coauthored_resolutions)))
-        active_repeal_total = (active_repeal_author
-                               + active_repeal_sub_coauthor
-                               + active_repeal_non_sub_coauthor)
-        bbcode += f'[td]{active_repeal_author}[/td]'
-        bbcode += f'[td]{active_repeal_sub_coauthor}[/td]'
-        bbcode += f'[td]{active_repeal_non_sub_coauthor}[/td]'
+        active_repeal_total = (c['active_repeal_author']
+                               + c['active_repeal_sub_coauthor']
+                               + c['active_repeal_non_sub_coauthor'])
+        bbcode += f'[td]{c["active_repeal_author"]}[/td]'
+        bbcode += f'[td]{c["active_repeal_sub_coauthor"]}[/td]'
+        bbcode += f'[td]{c["active_repeal_non_sub_coauthor"]}[/td]'
         bbcode += f'[td]{active_repeal_total}[/td]'
 
         active_total = active_non_repeal_total + active_repeal_total
         bbcode += f'[td]{active_total}[/td]'
 
-        repealed_author = len(list(filter(
-            lambda y: y.repealed_by and not y.coauthors,
-            author.authored_resolutions)))
-        repealed_sub_coauthor = len(list(filter(
-            lambda y: y.repealed_by and y.coauthors,
-            author.authored_resolutions)))
-        repealed_non_sub_coauthor = len(list(filter(
-            lambda y: y.repealed_by is not None,
-            author.coauthored_resolutions)))
-        repealed_total = (repealed_author + repealed_sub_coauthor
-                          + repealed_non_sub_coauthor)
-        bbcode += f'[td]{repealed_author}[/td]'
-        bbcode += f'[td]{repealed_sub_coauthor}[/td]'
-        bbcode += f'[td]{repealed_non_sub_coauthor}[/td]'
+        repealed_total = (c['repealed_author'] + c['repealed_sub_coauthor']
+                          + c['repealed_non_sub_coauthor'])
+        bbcode += f'[td]{c["repealed_author"]}[/td]'
+        bbcode += f'[td]{c["repealed_sub_coauthor"]}[/td]'
+        bbcode += f'[td]{c["repealed_non_sub_coauthor"]}[/td]'
         bbcode += f'[td]{repealed_total}[/td]'
 
         bbcode += f'[td]{active_total + repealed_total}[/td]'
         bbcode += '[/tr]'
+        yield bbcode
+
+    yield '[/table]'
 
-    bbcode += '[/table]'
 
-    return bbcode
+def generate_leaderboard(db: Database, keep_puppets=False):
+    """ The leaderboard as a bbCode table; shares its rows with the other leaderboard formats """
+    from src.reports.pandas_reports import Leaderboard  # pandas is only loaded if a leaderboard is asked for
+    return Leaderboard.of(db, keep_puppets).to_bbcode()
 
 
 def generate_known_aliases(db: Database):
+    return ''.join(iter_known_aliases(db))
+
+
+def iter_known_aliases(db: Database):
+    """ Yields the known aliases table in chunks: the header, then one per player row """
     bbcode = '[table]'
 
     bbcode += '[tr]'
     bbcode += '[td][b]Player[/b][/td]'
     bbcode += '[td][b]Aliases[/b][/td]'
     bbcode += '[/tr]'
+    yield bbcode
 
     players = sorted(list(db.aliases.keys()))
     for player in players:
-        bbcode += '[tr]'
+        bbcode = '[tr]'
         bbcode += f'[td]{player}[/td]'
         aliases = ', '.join([f'[nation]{x}[/nation]'
                              for x in sorted(db.aliases[player])])
         bbcode += f'[td]{aliases}[/td]'
         bbcode += '[/tr]'
+        yield bbcode
 
-    bbcode += '[/table]'
-
-    return bbcode
+    yield '[/table]'
@@ -0,0 +1,43 @@
+# Copyright (c) 2020 ifly6
+import io
+import os
+from datetime import datetime
+
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.ticker import AutoMinorLocator
+
+from src.helpers import write_bytes
+from src.load_db import Database
+from src.reports.pandas_reports import Leaderboard
+
+
+def create_leaderboard_chart(db: Database, paths, top=30):
+    """ Bar chart of the players with the most resolutions, saved to each of `paths`. Draws on its own `Figure` rather
+    than through pyplot, so it can be rendered off the main thread while other reports are written. """
+    ranks = Leaderboard.of(db, keep_puppets=False).to_pandas()  # same rows as the no-puppets markdown table
+    ranks['Name'] = ranks['Name'].str.replace(r'\[PLAYER\]', '', regex=True).str.strip()  # de-dup from players
+    ranks.drop_duplicates(subset='Name', keep='first', inplace=True)
+    ranks = ranks[ranks['Rank'] <= top]
+
+    f = Figure(figsize=(8.25, 11.71))
+    ax = f.subplots()
+    ax.barh(ranks['Name'], ranks['Total'], color=sns.color_palette('muted'), zorder=2)
+    ax.set_ylim([-1, ranks['Name'].size])
+    ax.invert_yaxis()
+    ax.xaxis.set_minor_locator(AutoMinorLocator())
+    ax.xaxis.grid(True, linestyle='dashed', which='major', zorder=0)
+    ax.xaxis.grid(True, linestyle='dotted', which='minor', zorder=0)
+    ax.set_title('Players with most WA resolutions')
+    ax.annotate(
+        'Data as of {}. See https://github.com/ifly6/WA-Authorboards.'.format(datetime.today().strftime('%Y-%m-%d')),
+        (0, 0), (0, -20), xycoords='axes fraction', textcoords='offset points', va='top'
+    )
+
+    f.tight_layout()
+    for path in paths:
+        fmt = os.path.splitext(path)[1][1:].lower()
+        buffer = io.BytesIO()
+        # without a creation date, the same chart renders to the same bytes; the file is then left alone
+        f.savefig(buffer, format=fmt, metadata={'CreationDate': None} if fmt == 'pdf' else None)
+        write_bytes(path, buffer.getvalue())
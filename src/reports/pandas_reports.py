@@ -1,11 +1,16 @@
 # Copyright (c) 2020 ifly6
+import threading
+import weakref
+
+import numpy as np
 import pandas as pd
 
+from src import instrument
 from src.load_db import Database
+from src.reports.author_stats import AuthorStats
 
-
-def _count(g):
-    return sum(1 for _ in g)
+_leaderboards = weakref.WeakKeyDictionary()  # database -> {keep_puppets: Leaderboard}
+_leaderboards_lock = threading.Lock()
 
 
 def _flatten(l):
@@ -53,54 +58,92 @@ def create_aliases(alias_path='', how='markdown'):
 
 
 def create_leaderboards(db: Database, how='markdown', keep_puppets=True):
-    # concat needs list
-    rows = []
-    for author in (db.authors + db.player_authors):
-        if author.is_player is False and author.name in _get_aliases() and keep_puppets is False:
-            continue  # if not keeping puppets, skip non-players who match alias list
-
-        d = {'Name': '[PLAYER] ' + author.name if author.is_player else author.name,
-             'Authored': len(author.authored_resolutions),
-             'Co-authored': len(author.coauthored_resolutions),
-             'Repeals': _count(r for r in author.authored_resolutions if r.category in ["Repeal", 'repeal']),
-             'Active': _count(r for r in author.authored_resolutions + author.coauthored_resolutions
-                              if r.repealed_by is None and r.category not in ['Repeal', 'repeal'])}
-        rows.append(d)
-    df = pd.DataFrame(rows)
-
-    # create totals and sort
-    df['Total'] = df['Authored'] + df['Co-authored']
-    df.sort_values(by=['Total', 'Name'], ascending=[False, True], inplace=True)
-    df.reset_index(drop=True, inplace=True)
-
-    # create ranking, but only if enumerating players
-    if keep_puppets is False:
-        df.insert(0, 'Rank', '')
-        for i, row in df.iterrows():
-            try:
-                same_total = row['Total'] == df.loc[i - 1, 'Total']
-            except KeyError:
-                same_total = False
-
-            df.loc[i, 'Rank'] = (df.loc[i - 1, 'Rank'] if same_total
-                                 else i + 1)
-
-    # output
-    if how == 'pandas':
-        return df
-
-    if how == 'markdown':
+    return Leaderboard.of(db, keep_puppets).render(how)
+
+
+class Leaderboard:
+    """ Leaderboard rows for a database, counted, sorted, and ranked once. Renderers work on a copy of the rows, so
+    the same leaderboard can be output in any number of formats for only the cost of formatting. Players are ranked
+    only when puppets are not kept. """
+
+    @instrument.timed('report.leaderboard')
+    def __init__(self, db: Database, keep_puppets=True):
+        self.keep_puppets = keep_puppets
+
+        stats = AuthorStats.of(db)
+        is_player = np.array([a.is_player for a in stats.authors], dtype=bool)
+        names = pd.Series(stats.names, dtype=object)
+        df = pd.DataFrame({
+            'Name': names.where(~is_player, '[PLAYER] ' + names),
+            'Authored': stats['authored'],
+            'Co-authored': stats['coauthored'],
+            'Repeals': stats['leaderboard_repeals'],
+            'Active': stats['leaderboard_active']
+        })
+
+        if keep_puppets is False:
+            # if not keeping puppets, skip non-players who match alias list
+            df = df[is_player | ~names.isin(_get_aliases()).values]
+
+        # create totals and sort
+        df['Total'] = df['Authored'] + df['Co-authored']
+        df.sort_values(by=['Total', 'Name'], ascending=[False, True], inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+        # create ranking, but only if enumerating players; tied totals share the highest rank (1, 2, 2, 4)
+        if keep_puppets is False:
+            ranks = df['Total'].rank(method='min', ascending=False).astype(int)
+            df.insert(0, 'Rank', ranks.astype(object))  # object column, as before, so string output is laid out the same
+
+        self.df = df
+
+    @staticmethod
+    def of(db: Database, keep_puppets=True) -> 'Leaderboard':
+        """ Leaderboard for `db`, computed the first time it is asked for with each puppet setting """
+        with _leaderboards_lock:
+            leaderboards = _leaderboards.setdefault(db, {})
+            if keep_puppets not in leaderboards:
+                leaderboards[keep_puppets] = Leaderboard(db, keep_puppets)
+            return leaderboards[keep_puppets]
+
+    def to_pandas(self) -> 'pd.DataFrame':
+        return self.df.copy()
+
+    def to_markdown(self) -> str:
+        df = self.to_pandas()
         df['Name'] = df['Name'].str.replace(r'\[PLAYER\]', r'**[PLAYER]**', regex=True)
         return df.to_markdown(index=False)
 
-    if how == 'bbCode' or how == 'bbcode':
+    def to_bbcode(self) -> str:
+        df = self.to_pandas()
         df['Name'] = '[nation]' + df['Name'].astype(str) + '[/nation]'
         return df_to_bbcode(df)
 
-    if how == 'string' or how == 'str':
-        return df.to_string(index=False)
-
-    if how == 'latex':
-        return df.to_latex(index=False)
-
-    raise ValueError(f'format string, {how}, invalid')
+    def to_string(self) -> str:
+        return self.df.to_string(index=False)
+
+    def to_latex(self) -> str:
+        return self.df.to_latex(index=False)
+
+    def to_csv(self) -> str:
+        return self.df.to_csv(index=False)
+
+    def to_json(self) -> str:
+        return self.df.to_json(orient='records')
+
+    def render(self, how='markdown'):
+        """ Renders in the format named by `how`; 'pandas' returns a copy of the rows themselves """
+        renderers = {
+            'pandas': self.to_pandas,
+            'markdown': self.to_markdown,
+            'bbCode': self.to_bbcode,
+            'bbcode': self.to_bbcode,
+            'string': self.to_string,
+            'str': self.to_string,
+            'latex': self.to_latex,
+            'csv': self.to_csv,
+            'json': self.to_json
+        }
+        if how not in renderers:
+            raise ValueError(f'format string, {how}, invalid')
+        return renderers[how]()
@@ -0,0 +1,189 @@
+# Copyright (c) 2020 ifly6
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import cache
+
+from src import instrument
+from src.helpers import _output_path, write_file, write_file_stream
+from src.load_db import Database
+
+_database = None  # set in each worker process by _set_database
+
+# code the reports are rendered by; a change to any of it changes every report's input hash
+_SOURCE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_REPORT_SOURCES = ['reports', 'load_db.py', 'helpers.py']
+
+
+@cache
+def source_digest() -> str:
+    """ Hash of the source of the report modules and the modules they read the database through """
+    h = hashlib.sha256()
+    for source in _REPORT_SOURCES:
+        path = os.path.join(_SOURCE_DIRECTORY, source)
+        paths = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.py')) \
+            if os.path.isdir(path) else [path]
+        for p in paths:
+            h.update(os.path.relpath(p, _SOURCE_DIRECTORY).encode('utf-8'))
+            with open(p, 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class ReportTask:
+    """ One output of the report stage, produced by calling `fn(db, *args, **kwargs)`. Tasks only read from the
+    database, so they can run side by side. With a process pool, `fn` and its arguments must be picklable, ie defined
+    at module level.
+
+    `inputs` are the files the output is derived from and `outputs` the files it writes. A `BuildManifest` uses them
+    to skip tasks whose inputs are unchanged since they last ran. """
+
+    def __init__(self, name, fn, *args, inputs=(), outputs=(), **kwargs):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+    def input_hash(self) -> str:
+        """ Hash of the task's input files, of how it is called, and of the report code (see `source_digest`).
+        Functions are described by name, so the hash is the same between runs. """
+        h = hashlib.sha256()
+        h.update(source_digest().encode('utf-8'))
+        h.update(repr([_describe(v) for v in (self.fn, self.args, sorted(self.kwargs.items()))]).encode('utf-8'))
+        for path in self.inputs:
+            h.update(path.encode('utf-8'))
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+        return h.hexdigest()
+
+    def run(self, db: Database) -> float:
+        """ Runs the task, returning how long it took in seconds """
+        start = time.perf_counter()
+        self.fn(db, *self.args, **self.kwargs)
+        elapsed = time.perf_counter() - start
+        instrument.add_time(f'report.task.{self.name}', elapsed)
+        return elapsed
+
+
+def _describe(v):
+    if callable(v) and hasattr(v, '__qualname__'):
+        return f'{v.__module__}.{v.__qualname__}'
+    if isinstance(v, (list, tuple)):
+        return [_describe(i) for i in v]
+    return repr(v)
+
+
+class BuildManifest:
+    """ Records, per task, the hash of the inputs its outputs were last built from, in a JSON file at `path`. A task
+    is up to date if its input hash is unchanged and all its outputs still exist. Tasks without inputs are always
+    run. """
+
+    def __init__(self, path='../db/cache/build_manifest.json'):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def is_current(self, task: ReportTask, input_hash: str) -> bool:
+        entry = self.entries.get(task.name)
+        return bool(task.inputs) and entry is not None \
+            and entry['inputs'] == input_hash \
+            and entry['outputs'] == task.outputs \
+            and all(os.path.exists(p) for p in task.outputs)
+
+    def record(self, task: ReportTask, input_hash: str):
+        self.entries[task.name] = {'inputs': input_hash, 'outputs': task.outputs}
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def _set_database(db):
+    global _database
+    _database = db
+
+
+def _run_in_worker(task: ReportTask):
+    return task.run(_database)
+
+
+def run_reports(db: Database, tasks, workers=4, processes=False, manifest: BuildManifest = None, force=False):
+    """ Runs report tasks over a shared database on a thread pool, or a process pool if `processes`, and prints how
+    long each took. Put slow tasks first so that they start first. Returns a dict of task name to seconds. Raises the
+    first exception from a failed task once the others have finished.
+
+    With a `manifest`, tasks whose inputs are unchanged since they last ran are skipped, and the manifest is updated
+    for those which succeed. If `force`, every task is run, and the manifest is still updated. """
+    start = time.perf_counter()
+    total = len(tasks)
+    skipped = []
+    hashes = {}
+    if manifest is not None:
+        hashes = {t.name: t.input_hash() for t in tasks if t.inputs}
+        skipped = [] if force else [t for t in tasks if manifest.is_current(t, hashes.get(t.name))]
+        for task in skipped:
+            print(f'skipped {task.name}; inputs unchanged')
+        tasks = [t for t in tasks if t not in skipped]
+
+    if processes:
+        # send the database once per worker, rather than once per task
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_set_database, initargs=(db,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    timings = {}
+    errors = []
+    with executor:
+        futures = {(executor.submit(_run_in_worker, t) if processes else executor.submit(t.run, db)): t
+                   for t in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            try:
+                timings[task.name] = future.result()
+                print(f'wrote {task.name} in {timings[task.name]:.2f} s')
+                if task.name in hashes:
+                    manifest.record(task, hashes[task.name])
+            except Exception as e:
+                print(f'failed to write {task.name}: {e!r}')
+                errors.append(e)
+
+    if manifest is not None:
+        manifest.save()
+
+    elapsed = time.perf_counter() - start
+    print(f'ran {len(timings)}, skipped {len(skipped)} of {total} reports in {elapsed:.2f} s wall time, '
+          f'{sum(timings.values()):.2f} s task time')
+    if errors:
+        raise errors[0]
+    return timings
+
+
+def text_task(name, path, render, *args, inputs=(), print_input=False, **kwargs) -> ReportTask:
+    """ Task writing the string from `render(db, *args, **kwargs)` to `path`, built from files `inputs` """
+    return ReportTask(name, write_text, path, render, *args, inputs=inputs, outputs=[_output_path(path)],
+                      print_input=print_input, **kwargs)
+
+
+def stream_task(name, path, render, *args, inputs=(), **kwargs) -> ReportTask:
+    """ Task streaming the chunks from `render(db, *args, **kwargs)` to `path`, built from files `inputs` """
+    return ReportTask(name, write_stream, path, render, *args, inputs=inputs, outputs=[_output_path(path)], **kwargs)
+
+
+def write_text(db: Database, path, render, *args, print_input=False, **kwargs):
+    """ Task writing the string returned by `render(db, *args, **kwargs)` to `path` """
+    write_file(path, render(db, *args, **kwargs), print_input=print_input)
+
+
+def write_stream(db: Database, path, render, *args, **kwargs):
+    """ Task streaming the chunks yielded by `render(db, *args, **kwargs)` to `path` """
+    write_file_stream(path, render(db, *args, **kwargs))
@@ -1,37 +1,85 @@
 # Copyright (c) 2020 ifly6
+import argparse
 import glob
 import json
-from datetime import datetime
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
 from functools import cache
 from json import JSONDecodeError
-from os.path import getsize
+from os.path import getmtime, getsize
+
+from src import instrument
+
+DEFAULT_BACKEND = 'sqlite'
 
 
 class Cacher(object):
     """ Caches all the API responses and persists it as `api_cache.json`. If you want to re-pull that data, delete the
-    cache file and it will do that automatically. """
+    cache file and it will do that automatically.
+
+    Loading and saving read and write the whole file, so keep one cacher open for a run (see `Cacher.open`) and call
+    `flush` at checkpoints rather than loading and saving around every response. """
 
     def __init__(self, d=None):
         if d is None:
             d = {}  # stupid python
 
         self.d = d
+        self.dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
 
     def contains(self, key):
-        return key in self.d
+        found = key in self.d
+        instrument.count('cache.hits' if found else 'cache.misses')
+        return found
 
     def get(self, key):
         return self.d[key]
 
-    def update(self, k, v):
+    def keys(self):
+        return list(self.d)
+
+    def get_meta(self, key):
+        """ The JSON cache does not keep response headers, so responses from it are never revalidated """
+        return {}
+
+    def update(self, k, v, fetched_at=None, meta=None):
         self.d[k] = v
+        self.dirty = True
+
+    def flush(self, path=None):
+        """ Saves only if something has been updated since the last save """
+        if self.dirty:
+            self.save(path)
 
     def save(self, path=None):
         if path is None:
             path = '../db/cache/api_cache_{}.json'.format(datetime.now().strftime('%Y-%m-%d'))
 
-        with open(path, 'w', encoding='utf-8') as f:
+        with instrument.timed('cache.save'), open(path, 'w', encoding='utf-8') as f:
             json.dump(self.d, f, ensure_ascii=False, indent=4)
+            instrument.count('cache.bytes_written', f.tell())
+
+        self.dirty = False
+
+    @staticmethod
+    def open(path=None):
+        """ Loads the cache for a run, or starts an empty one if nothing has been saved yet """
+        try:
+            return Cacher.load(path)
+        except (FileNotFoundError, IndexError):
+            return Cacher()  # init new
 
     @staticmethod
     def load(path=None, attempt=0):
@@ -43,6 +91,7 @@ class Cacher(object):
         with open(path, 'r') as f:
             try:
                 d = json.load(f)
+                instrument.count('cache.bytes_read', f.tell())
                 return Cacher(d)
             except JSONDecodeError as e:
                 if attempt == 0:
@@ -52,8 +101,432 @@ class Cacher(object):
                     raise e
 
 
+class _FileCacher(object):
+    """ What the single file caches have in common: flushing only when there are pending writes, and importing the
+    JSON caches into a new file. Subclasses set `default_path` and implement `update` and `save`. """
+    default_path = None
+
+    def flush(self, path=None):
+        if self.dirty:
+            self.save(path)
+
+    def import_json(self, paths=None):
+        """ One-shot import of existing JSON caches. Returns the number of rows read. """
+        count = 0
+        for d, fetched_at in _read_json_caches(paths):
+            for k, v in d.items():
+                self.update(k, v, fetched_at)
+            count += len(d)
+
+        self.flush()
+        return count
+
+    @classmethod
+    def open(cls, path=None):
+        """ Opens the cache, importing any JSON caches the first time its file is created """
+        if path is None:
+            path = cls.default_path
+        is_new = not os.path.exists(path)
+        cacher = cls(path)
+        if is_new:
+            cacher.import_json()
+        return cacher
+
+
+class SqliteCacher(_FileCacher):
+    """ Drop-in replacement for `Cacher` backed by a single SQLite file. Responses are keyed by API url and stored
+    with the time they were fetched. Each `update` is an indexed upsert and nothing is read into memory up front, so
+    there is no cost to opening the cache. Writes are committed on `flush` (or `save`).
+
+    Worker threads in `wa_parser.fetch_resolutions` read from the cache, so the connection is shared under a lock. """
+    default_path = '../db/cache/api_cache.sqlite'
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'url TEXT PRIMARY KEY, '
+            'response TEXT NOT NULL, '
+            'fetched_at TEXT NOT NULL, '
+            'etag TEXT, '
+            'last_modified TEXT)'
+        )
+
+        # caches created before validators were stored lack the header columns
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(responses)')]
+        for column in ['etag', 'last_modified']:
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE responses ADD COLUMN {column} TEXT')
+
+        self.connection.commit()
+        self.dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def contains(self, key):
+        with self.lock:
+            found = self.connection.execute('SELECT 1 FROM responses WHERE url = ?', (key,)).fetchone() is not None
+        instrument.count('cache.hits' if found else 'cache.misses')
+        return found
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT response FROM responses WHERE url = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        instrument.count('cache.bytes_read', len(row[0]))
+        return row[0]
+
+    def keys(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT url FROM responses')]
+
+    def fetched_at(self, key):
+        """ Time the response for `key` was stored, as an aware UTC datetime """
+        with self.lock:
+            row = self.connection.execute('SELECT fetched_at FROM responses WHERE url = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return datetime.fromisoformat(row[0])
+
+    def get_meta(self, key):
+        """ Validators (`etag`, `last_modified`) sent with the cached response, for conditional requests """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT etag, last_modified FROM responses WHERE url = ?', (key,)).fetchone()
+        if row is None:
+            return {}
+        return {k: v for k, v in zip(['etag', 'last_modified'], row) if v is not None}
+
+    def update(self, k, v, fetched_at=None, meta=None):
+        if fetched_at is None:
+            fetched_at = datetime.now(timezone.utc)
+        if meta is None:
+            meta = {}
+
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO responses (url, response, fetched_at, etag, last_modified) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET response = excluded.response, fetched_at = excluded.fetched_at, '
+                'etag = excluded.etag, last_modified = excluded.last_modified',
+                (k, v, fetched_at.isoformat(), meta.get('etag'), meta.get('last_modified'))
+            )
+            self.dirty = True
+        instrument.count('cache.bytes_written', len(v))
+
+    def save(self, path=None):
+        """ Commits pending writes. `path` is accepted for compatibility with `Cacher` and ignored. """
+        with instrument.timed('cache.save'), self.lock:
+            self.connection.commit()
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+
+class JournalCacher(_FileCacher):
+    """ Drop-in replacement for `Cacher` that appends zlib-compressed records to a journal file. Each record is a
+    fixed header (url, metadata, and payload lengths; fetch time) followed by the url, the response validators as
+    JSON, and the compressed response. Writes are
+    appends; reads seek straight to the record through an in-memory offset index, which is persisted beside the
+    journal on `flush` and rebuilt by scanning record headers if it is missing or stale.
+
+    Updating a url appends a new record and leaves the old one in place, so run `compact` now and then. """
+
+    _header = struct.Struct('>IIId')
+    default_path = '../db/cache/api_cache.journal'
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.lock = threading.Lock()
+        self.index = {}  # url -> (payload offset, payload length, fetched at, validators)
+
+        self.writer = open(path, 'ab')
+        self.reader = open(path, 'rb')
+        self.dirty = False
+        self.buffered = False  # appends the reader cannot see until the writer is flushed
+        self._load_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _load_index(self):
+        size = os.path.getsize(self.path)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved['size'] == size:
+                self.index = {k: tuple(v) for k, v in saved['index'].items()}
+                return
+        except (FileNotFoundError, JSONDecodeError, KeyError):
+            pass
+
+        # index missing or out of date; scan the headers, skipping over the payloads
+        self.index = {}
+        offset = 0
+        self.reader.seek(0)
+        while offset + self._header.size <= size:
+            key_length, meta_length, data_length, fetched_at = \
+                self._header.unpack(self.reader.read(self._header.size))
+            data_offset = offset + self._header.size + key_length + meta_length
+            if data_offset + data_length > size:
+                break  # torn write at the end of the journal
+
+            key = self.reader.read(key_length).decode('utf-8')
+            meta = json.loads(self.reader.read(meta_length).decode('utf-8'))
+            self.index[key] = (data_offset, data_length, fetched_at, meta)
+            offset = data_offset + data_length
+            self.reader.seek(offset)
+
+        if offset != size:
+            print(f'truncating {size - offset} bytes of incomplete records from {self.path}')
+            self.writer.truncate(offset)
+            self.writer.seek(offset)
+
+        self.dirty = True  # so the rebuilt index is written out
+
+    def contains(self, key):
+        found = key in self.index
+        instrument.count('cache.hits' if found else 'cache.misses')
+        return found
+
+    def get(self, key):
+        data_offset, data_length, _, _ = self.index[key]
+        with self.lock:
+            if self.buffered:
+                self.writer.flush()
+                self.buffered = False
+            self.reader.seek(data_offset)
+            data = self.reader.read(data_length)
+        instrument.count('cache.bytes_read', data_length)
+        return zlib.decompress(data).decode('utf-8')
+
+    def keys(self):
+        return list(self.index)
+
+    def fetched_at(self, key):
+        """ Time the response for `key` was stored, as an aware UTC datetime """
+        return datetime.fromtimestamp(self.index[key][2], timezone.utc)
+
+    def get_meta(self, key):
+        """ Validators (`etag`, `last_modified`) sent with the cached response, for conditional requests """
+        return dict(self.index[key][3]) if key in self.index else {}
+
+    def update(self, k, v, fetched_at=None, meta=None):
+        if fetched_at is None:
+            fetched_at = datetime.now(timezone.utc)
+        if meta is None:
+            meta = {}
+
+        key = k.encode('utf-8')
+        meta_bytes = json.dumps(meta).encode('utf-8')
+        data = zlib.compress(v.encode('utf-8'))
+        with self.lock:
+            offset = self.writer.tell()
+            self.writer.write(self._header.pack(len(key), len(meta_bytes), len(data), fetched_at.timestamp()))
+            self.writer.write(key)
+            self.writer.write(meta_bytes)
+            self.writer.write(data)
+            data_offset = offset + self._header.size + len(key) + len(meta_bytes)
+            self.index[k] = (data_offset, len(data), fetched_at.timestamp(), meta)
+            self.dirty = True
+            self.buffered = True
+        instrument.count('cache.bytes_written', data_offset + len(data) - offset)
+
+    def save(self, path=None):
+        """ Flushes appended records and persists the index. `path` is accepted for compatibility with `Cacher` and
+        ignored. """
+        with instrument.timed('cache.save'), self.lock:
+            self.writer.flush()
+            self.buffered = False
+            os.fsync(self.writer.fileno())
+            with open(self.index_path, 'w', encoding='utf-8') as f:
+                json.dump({'size': self.writer.tell(), 'index': self.index}, f)
+            self.dirty = False
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.reader.close()
+
+    def compact(self):
+        """ Rewrites the journal keeping only the latest record for each url. Returns bytes saved. """
+        self.flush()
+        before = os.path.getsize(self.path)
+        temp_path = self.path + '.compacting'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        with JournalCacher(temp_path) as compacted:
+            for k in sorted(self.index):
+                compacted.update(k, self.get(k), self.fetched_at(k), self.get_meta(k))
+
+        self.writer.close()
+        self.reader.close()
+        os.replace(temp_path, self.path)
+        os.replace(temp_path + '.idx', self.index_path)
+        self.__init__(self.path)
+        return before - os.path.getsize(self.path)
+
+
+
+def _read_json_caches(paths=None):
+    """ Yields the contents of JSON caches oldest first, so that newer responses win when imported in order, with
+    each file's modification time as the fetch time of its responses. """
+    if paths is None:
+        paths = glob.glob('../db/cache/api_cache*.json')
+
+    for path in sorted(paths, key=getmtime):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+        except JSONDecodeError:
+            print(f'skipping unreadable cache {path}')
+            continue
+
+        print(f'read {len(d)} responses from {path}')
+        yield d, datetime.fromtimestamp(getmtime(path), timezone.utc)
+
+
+@instrument.timed('cache.open')
+def open_cache(backend=None):
+    """ Opens the API response cache for a run. `backend` is 'json', 'sqlite', or 'journal'; defaults to
+    `DEFAULT_BACKEND`. """
+    if backend is None:
+        backend = DEFAULT_BACKEND
+
+    if backend == 'json':
+        return Cacher.open()
+    if backend == 'sqlite':
+        return SqliteCacher.open()
+    if backend == 'journal':
+        return JournalCacher.open()
+    raise ValueError(f'cache backend {backend} invalid')
+
+
+def check_read_after_write(cacher, key='https://example.com/read-after-write', value='<WA></WA>' * 10):
+    """ Raises `ValueError` unless a response can be read back from `cacher` as soon as it is written, before any
+    flush, as `wa_parser` does with the responses it caches while finding the newest resolution """
+    cacher.update(key, value)
+    if cacher.get(key) != value:
+        raise ValueError(f'cacher {type(cacher).__name__} invalid; response read back differs from that written')
+
+
+def compare_backends(json_path=None, directory=None):
+    """ Loads a JSON cache into each backend and prints the size on disk and the time taken to write everything, read
+    everything back, and re-open the cache. Returns the results as a list of dicts. """
+    if json_path is None:
+        fs = glob.glob('../db/cache/api_cache*.json')
+        json_path = max(fs, key=getsize)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        d = json.load(f)
+
+    directory = tempfile.mkdtemp() if directory is None else directory
+    results = []
+
+    def timed(fn):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    def write_all(cacher, path=None):
+        for k, v in d.items():
+            cacher.update(k, v)
+        check_read_after_write(cacher)
+        cacher.save(path)
+
+    def read_all(cacher):
+        for k in d:
+            cacher.get(k)
+
+    # json; every save rewrites the whole file
+    path = os.path.join(directory, 'api_cache.json')
+    json_cacher = Cacher()
+    write = timed(lambda: write_all(json_cacher, path))
+    reopen = timed(lambda: Cacher.load(path))
+    read = timed(lambda: read_all(json_cacher))
+    results.append({'backend': 'json', 'bytes': getsize(path), 'write': write, 'read': read, 'open': reopen})
+
+    for name, cls, filename in [('sqlite', SqliteCacher, 'api_cache.sqlite'),
+                                ('journal', JournalCacher, 'api_cache.journal')]:
+        path = os.path.join(directory, filename)
+        with cls(path) as cacher:
+            write = timed(lambda: write_all(cacher))
+        reopen = timed(lambda: cls(path).close())
+        with cls(path) as cacher:
+            read = timed(lambda: read_all(cacher))
+        results.append({'backend': name, 'bytes': getsize(path), 'write': write, 'read': read, 'open': reopen})
+
+    print(f'{len(d)} responses from {json_path}')
+    print('{:<8} {:>12} {:>10} {:>10} {:>10}'.format('backend', 'bytes', 'write s', 'read s', 'open s'))
+    for r in results:
+        print('{backend:<8} {bytes:>12,} {write:>10.3f} {read:>10.3f} {open:>10.3f}'.format(**r))
+    return results
+
+
 @cache
 def load_capitalisation_exceptions(p='../db/names.txt'):
-    """ Cached to reduce disk IO times on repeated calls. Data here should not change. """
+    """ Names as they should be capitalised, in file order. Cached to reduce disk IO times on repeated calls. Data
+    here should not change. """
     with open(p, 'r') as f:
-        return set(f.readlines())
+        return tuple(line.strip() for line in f if line.strip())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m src.wa_cacher',
+                                     description='Manage the API response cache. Run from the repository root, eg '
+                                                 '"python -m src.wa_cacher compact"; paths given are relative to '
+                                                 'where it is run from, and the defaults are in db/cache.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import-json', help='import JSON caches into the SQLite cache')
+    import_parser.add_argument('paths', nargs='*', help='JSON caches to import; defaults to all in db/cache')
+    import_parser.add_argument('--db', help='SQLite cache to import into; default db/cache/api_cache.sqlite')
+
+    compact_parser = subparsers.add_parser('compact', help='drop superseded records from the journal cache')
+    compact_parser.add_argument('--journal', help='journal to compact; default db/cache/api_cache.journal')
+
+    compare_parser = subparsers.add_parser('compare', help='compare cache backends on size and throughput')
+    compare_parser.add_argument('path', nargs='?', help='JSON cache to compare with; defaults to the largest')
+
+    args = parser.parse_args()
+
+    # paths given are relative to where we were run from; the defaults are relative to src
+    for name in ['db', 'journal', 'path']:
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if getattr(args, 'paths', None):
+        args.paths = [os.path.abspath(p) for p in args.paths]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    if args.command == 'import-json':
+        with SqliteCacher(args.db or SqliteCacher.default_path) as sqlite_cacher:
+            n = sqlite_cacher.import_json(args.paths if args.paths else None)
+            print(f'imported {n} responses; cache now holds {len(sqlite_cacher)}')
+
+    if args.command == 'compact':
+        with JournalCacher(args.journal or JournalCacher.default_path) as journal_cacher:
+            saved = journal_cacher.compact()
+            print(f'compacted {journal_cacher.path} to {len(journal_cacher)} records; saved {saved:,} bytes')
+
+    if args.command == 'compare':
+        compare_backends(args.path)
@@ -2,21 +2,26 @@
 import html
 import io
 import re
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from functools import cache
-from typing import Tuple
+from typing import NamedTuple, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from lxml import etree
 from pytz import timezone
 from ratelimit import limits, sleep_and_retry
 
-from helpers import ref
-from load_db import is_same_name
-from src import wa_cacher
+from src.helpers import ref
+from src.load_db import latest_database
+from src import fetch_checkpoint, instrument, wa_cacher
+from src.capitaliser import Capitaliser
+from src.coauthors import find_coauthor_line, split_coauthor_line
 
 """ Imperium Anglorum:
 
@@ -32,20 +37,66 @@ _headers = {
     'User-Agent': 'WA parser (Auralia; Imperium Anglorum)'
 }
 
+# one pooled session for every request, so connections are reused rather than set up per call
+_session = requests.Session()
+_session.headers.update(_headers)
+_session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=16))
+_session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=16))
+
+_RATE_LIMIT_CALLS = 25  # 50 calls every 30 seconds they say but somehow this is fake news
+_RATE_LIMIT_PERIOD = 30
+
 
 class ApiError(Exception):
     pass
 
 
+class NoSuchResolution(ValueError):
+    """ The API answered without a resolution, ie the number has not passed (yet). Other `ValueError`s from decoding
+    mean that a resolution came back malformed. """
+    pass
+
+
 @sleep_and_retry
-@limits(calls=25, period=30)  # 50 calls every 30 seconds they say but somehow this is fake news
+@limits(calls=_RATE_LIMIT_CALLS, period=_RATE_LIMIT_PERIOD)  # shared by every thread calling the api
+def _get(url, headers=None) -> 'requests.Response':
+    with instrument.timed('api.request'):
+        response = _session.get(url, headers=headers)
+    instrument.count('api.calls')
+    instrument.count('api.bytes_read', len(response.content))
+    return response
+
+
 def call_api(url) -> str:
-    response = requests.get(url, headers=_headers)
+    response = _get(url)
     if response.status_code != 200:
         raise ApiError('{} error at api url: {}'.format(response.status_code, str(url)))
     return response.text
 
 
+def call_api_conditional(url, meta=None) -> Tuple[Optional[str], dict]:
+    """ Sends a conditional request using the validators in `meta` (as stored by the cacher). Returns the response
+    text and its validators, or `None` and the old validators if the server says the response is unchanged. """
+    if meta is None:
+        meta = {}
+
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    response = _get(url, headers=headers)
+    if response.status_code == 304:
+        instrument.count('api.not_modified')
+        return None, meta
+    if response.status_code != 200:
+        raise ApiError('{} error at api url: {}'.format(response.status_code, str(url)))
+
+    new_meta = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    return response.text, {k: v for k, v in new_meta.items() if v is not None}
+
+
 def clean_chamber_input(chamber):
     """ Turns ambiguous chamber information into tuple (int, str) with chamber id and chamber name """
     if type(chamber) == str:
@@ -67,6 +118,11 @@ def localised(dt: 'datetime', tz='US/Eastern'):
     return timezone(tz).localize(dt)
 
 
+def _eastern_time(unix_time):
+    """ Unix time from the API as an aware datetime in eastern time """
+    return localised(datetime.utcfromtimestamp(unix_time), 'UTC').astimezone(timezone('US/Eastern'))
+
+
 @cache
 def _category_map():
     d = {'Advancement of Industry': 'Environmental Deregulation',
@@ -97,45 +153,85 @@ def _translate_category(category: str, s: str) -> Tuple[bool, str]:
     return False, s
 
 
+@cache
+def _capitaliser() -> Capitaliser:
+    return Capitaliser(wa_cacher.load_capitalisation_exceptions())
+
+
+@instrument.timed('parse.capitalise')
 def capitalise(s):
-    s = s.replace('_', ' ').strip()
-
-    # exceptions
-    capitalisation_exceptions = wa_cacher.load_capitalisation_exceptions()
-    for i in capitalisation_exceptions:
-        if is_same_name(s, i):
-            return i  # replace with manual correction
-
-    # only capitalise words longer than 2 letters ('new') and always capitalise first
-    # unless the word is in given list
-    # > fanboys & the
-    s = " ".join(
-        w.capitalize()
-        if (len(w) > 2 and w not in ['for', 'and', 'nor', 'but', 'yet', 'the']) or (i == 0)
-        else w
-        for i, w in enumerate(s.split())
-    ).strip()  # avoid apostrophe capitalisations
-
-    # but capitalise st -> St
-    for exception in ['St']:
-        s = ' '.join((exception if w.lower() == exception.lower() else w)
-                     for w in s.split())
-
-    # for split in ['-']:
-    #     # as first should always be capitalised, not checking doesn't matter
-    #     s = split.join(w[:1].upper() + w[1:] for i, w in enumerate(s.split(split)))  # capitalise first letter only
-    # "Christian DeMocrats"
-    # python str.capitalize forces all other chars to lower
-    # don't use str.capitalize above
-
-    for numeral in ['ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x']:
-        s = re.sub(r'(?<=\s){}$'.format(numeral), numeral.upper(), s)  # matches only trailing numerals
-
-    # people used to use WA missions; capitalise these, they are separate words
-    s = re.sub(r'(?<=\s)(Wa|wa|wA)(?=\s)', 'WA', s)  # if between two spaces
-    s = re.sub(r'^(Wa|wa|wA)(?=\s)', 'WA', s)  # if at start (eg WA Mission of NERV-UN)
-
-    return s
+    return _capitaliser().capitalise(s)
+
+
+def capitalise_all(values) -> list:
+    """ Capitalises a whole column of names at once; see `Capitaliser.capitalise_all` """
+    return _capitaliser().capitalise_all(values)
+
+
+class ResolutionXml(NamedTuple):
+    """ Fields of a resolution as given in an API response, before any cleaning """
+    name: str
+    category: str
+    option: str
+    council: str
+    implemented: int
+    proposed_by: Optional[str]
+    desc: Optional[str]
+    votes_for: int
+    votes_against: int
+    repealed_by: Optional[int]
+    repeals: Optional[int]
+    coauthors: Tuple[Optional[str], ...]
+
+
+_XML_FIELDS = {'NAME', 'CATEGORY', 'OPTION', 'COUNCIL', 'IMPLEMENTED', 'PROPOSED_BY', 'DESC', 'TOTAL_VOTES_FOR',
+               'TOTAL_VOTES_AGAINST', 'REPEALED_BY', 'REPEALS_COUNCILID'}
+
+
+def read_resolution_xml(response: Union[str, bytes]) -> Optional[ResolutionXml]:
+    """ Reads a resolution from an API response, as text or raw bytes, in one pass over the children of its
+    RESOLUTION element. Where a field appears more than once, the first is taken. Returns `None` if the response holds
+    no resolution; raises `ValueError` if it holds one with a required field missing. """
+    if isinstance(response, bytes):
+        root = etree.fromstring(response)
+    else:
+        try:
+            root = etree.fromstring(response)
+        except ValueError:  # lxml refuses str with an encoding declaration, which a file-like object may have
+            root = etree.parse(io.StringIO(response)).getroot()
+
+    fields = {}
+    coauthors = []
+    if root.tag == 'WA':
+        for resolution in root.iterchildren('RESOLUTION'):
+            for child in resolution:
+                if child.tag == 'COAUTHOR':
+                    coauthors.extend(n.text for n in child.iterchildren('N'))
+                elif child.tag in _XML_FIELDS and child.tag not in fields:
+                    fields[child.tag] = child.text
+
+    if 'NAME' not in fields:
+        return None
+
+    def required(tag):
+        if tag not in fields:
+            raise ValueError(f'resolution {fields["NAME"]} field {tag} missing')
+        return fields[tag]
+
+    return ResolutionXml(
+        name=fields['NAME'],
+        category=required('CATEGORY'),
+        option=required('OPTION'),
+        council=required('COUNCIL'),
+        implemented=int(required('IMPLEMENTED')),
+        proposed_by=required('PROPOSED_BY'),
+        desc=required('DESC'),
+        votes_for=int(required('TOTAL_VOTES_FOR')),
+        votes_against=int(required('TOTAL_VOTES_AGAINST')),
+        repealed_by=int(fields['REPEALED_BY']) if 'REPEALED_BY' in fields else None,
+        repeals=int(fields['REPEALS_COUNCILID']) if 'REPEALS_COUNCILID' in fields else None,
+        coauthors=tuple(coauthors)
+    )
 
 
 def _get_council(i):
@@ -180,33 +276,54 @@ class WaPassedResolution:
 
         self.__dict__.update(kwargs)  # django does this automatically, i'm not updating it; lazy
 
-    @staticmethod
-    def parse_ga(res_num, council=1):
+    def to_record(self) -> dict:
+        """ The resolution as a dict which can be saved as JSON, without the text, for `fetch_checkpoint` """
+        record = {k: v for k, v in self.__dict__.items() if k != 'text'}
+        record['implementation'] = int(self.implementation.timestamp())
+        return record
 
-        from src.wa_cacher import Cacher
-        try:
-            cacher = Cacher.load()
-        except FileNotFoundError:
-            cacher = Cacher()  # init new
+    @staticmethod
+    def from_record(record: dict):
+        """ Inverse of `to_record`; the text is left `None` """
+        return WaPassedResolution(**dict(record, implementation=_eastern_time(record['implementation'])))
 
-        api_url = 'https://www.nationstates.net/cgi-bin/api.cgi?wa={}&id={}&q=resolution'.format(council, res_num)
+    @staticmethod
+    def parse_ga(res_num, council=1, cacher=None, stats=None):
+        """ Gets the resolution from the cache or the API. If no `cacher` is given, the cache is loaded and saved just
+        for this resolution; when parsing many, open one with `wa_cacher.open_cache` and pass it in instead. """
+        if cacher is None:
+            with wa_cacher.open_cache() as cacher:
+                return WaPassedResolution.parse_ga(res_num, council, cacher, stats)
+
+        api_url = _api_url(res_num, council)
         in_cacher = cacher.contains(api_url)
         if not in_cacher:
-            this_response = call_api(api_url)
-            cacher.update(api_url, this_response)
+            this_response, meta = call_api_conditional(api_url)
         else:
             this_response = cacher.get(api_url)
+        if stats is not None:  # before decoding, so that requests finding no resolution are counted too
+            stats.record(FetchStats.CACHE_HIT if in_cacher else FetchStats.FETCHED)
+
+        resolution = WaPassedResolution.from_response(res_num, this_response, council)
+        if not in_cacher:
+            cacher.update(api_url, this_response, meta=meta)  # only cache responses which decode properly
+        return resolution
 
-        xml = etree.parse(io.StringIO(this_response))
-        if not xml.xpath('/WA/RESOLUTION/NAME'):
-            raise ValueError(f'resolution number {res_num} is invalid; no such resolution exists')
+    @staticmethod
+    @instrument.timed('parse.from_response')
+    def from_response(res_num, this_response, council=1):
+        """ Builds the resolution from a raw API response, as text or bytes. Raises `ValueError` if the response holds
+        no resolution. """
+        xml = read_resolution_xml(this_response)
+        if xml is None:
+            raise NoSuchResolution(f'resolution number {res_num} is invalid; no such resolution exists')
 
-        resolution_is_repealed = xml.xpath('/WA/RESOLUTION/REPEALED_BY') != []
-        resolution_is_a_repeal = xml.xpath('/WA/RESOLUTION/REPEALS_COUNCILID') != []
+        resolution_is_repealed = xml.repealed_by is not None
+        resolution_is_a_repeal = xml.repeals is not None
 
-        resolution_text = html.unescape(xml.xpath('/WA/RESOLUTION/DESC')[0].text)
+        resolution_text = html.unescape(xml.desc)
 
-        resolution_author = xml.xpath('/WA/RESOLUTION/PROPOSED_BY')[0].text
+        resolution_author = xml.proposed_by
         print(resolution_author)
         print(type(resolution_author))
         if resolution_author is None or str(resolution_author).strip() == '':
@@ -217,33 +334,27 @@ class WaPassedResolution:
         resolution = WaPassedResolution(
             council=_get_council(council),
             resolution_num=res_num,
-            title=xml.xpath('/WA/RESOLUTION/NAME')[0].text,
-            implementation=localised(
-                datetime.utcfromtimestamp(int(xml.xpath('/WA/RESOLUTION/IMPLEMENTED')[0].text)),
-                'UTC'
-            ).astimezone(timezone('US/Eastern')),  # convert to eastern time
-            chamber=clean_chamber_input(xml.xpath('/WA/RESOLUTION/COUNCIL')[0].text)[1],
-
-            category=capitalise(xml.xpath('/WA/RESOLUTION/CATEGORY')[0].text),
+            title=xml.name,
+            implementation=_eastern_time(xml.implemented),
+            chamber=clean_chamber_input(xml.council)[1],
+
+            category=capitalise(xml.category),
             strength=capitalise(
-                _translate_category(
-                    xml.xpath('/WA/RESOLUTION/CATEGORY')[0].text,  # category
-                    xml.xpath('/WA/RESOLUTION/OPTION')[0].text  # option
-                )[1]  # get name
+                _translate_category(xml.category, xml.option)[1]  # get name
             ),
 
             is_repealed=resolution_is_repealed,
-            repealed_by=int(xml.xpath('/WA/RESOLUTION/REPEALED_BY')[0].text) if resolution_is_repealed else None,
+            repealed_by=xml.repealed_by,
             is_repeal=resolution_is_a_repeal,
-            repeals=int(xml.xpath('/WA/RESOLUTION/REPEALS_COUNCILID')[0].text) if resolution_is_a_repeal else None,
+            repeals=xml.repeals,
 
             # text and author
             text=resolution_text.strip(),
             author=author.strip(),
 
             # vote data
-            votes_for=int(xml.xpath('/WA/RESOLUTION/TOTAL_VOTES_FOR')[0].text),
-            votes_against=int(xml.xpath('/WA/RESOLUTION/TOTAL_VOTES_AGAINST')[0].text)
+            votes_for=xml.votes_for,
+            votes_against=xml.votes_against
         )
 
         assert resolution.strength != '0', 'resolution {} has strength 0 with category {}'.format(
@@ -255,60 +366,32 @@ class WaPassedResolution:
             resolution.strength = str(int(resolution.repeals))  # cast to integer
 
         # check for co-authors
-        coauth_list = xml.xpath('/WA/RESOLUTION/COAUTHOR/N')
+        coauth_list = xml.coauthors
         if len(coauth_list) != 0:
             print('received from API coauthors: {}'.format(
-                ', '.join([capitalise(n.text) for n in coauth_list])
+                ', '.join([capitalise(n) for n in coauth_list])
             ))
 
             try:
-                resolution.coauthor0 = capitalise(coauth_list[0].text)
+                resolution.coauthor0 = capitalise(coauth_list[0])
             except IndexError:
                 pass
 
             try:
-                resolution.coauthor1 = capitalise(coauth_list[1].text)
+                resolution.coauthor1 = capitalise(coauth_list[1])
             except IndexError:
                 pass
 
             try:
-                resolution.coauthor2 = capitalise(coauth_list[2].text)
+                resolution.coauthor2 = capitalise(coauth_list[2])
             except IndexError:
                 pass
 
         else:
-            cleaned_resolution_text = resolution_text \
-                .replace('[i]', '').replace('[/i]', '') \
-                .replace('[b]', '').replace('[/b]', '') \
-                .replace('[u]', '').replace('[/u]', '')
-            coauthor_matches = [s for s in cleaned_resolution_text.splitlines()
-                                if re.search(
-                    r'(Co-?((Author(ed)?:?)|written|writer) ?(by|with)? ?:?)|'
-                    r'(This resolution includes significant contributions made by\s+)',
-                    s, re.IGNORECASE
-                )]
-            if len(coauthor_matches) > 0:
-                coauthor_line = re.sub(r'Co-?((Author(ed)?:?)|written|writer) ?(by|with)? ?:? ', repl='',
-                                       string=coauthor_matches[0], flags=re.IGNORECASE)
+            coauthor_line = find_coauthor_line(resolution_text)
+            if coauthor_line is not None:
                 print(f'\tidentified coauthor line: "{coauthor_line}"')
-                coauthor_line = coauthor_line \
-                    .replace('[i]', '') \
-                    .replace('[/i]', '') \
-                    .replace('[b]', '') \
-                    .replace('[/b]', '') \
-                    .replace('[u]', '') \
-                    .replace('[/u]', '')
-
-                if '[nation' in coauthor_line.lower():  # scion used the [Nation] tag instead of lower case once
-                    amended_line = re.sub(r'(?<=\[nation)=(.*?)(?=\])', '', coauthor_line.lower())  # remove 'noflag' etc
-                    coauthors = re.findall(r'(?<=\[nation\])(.*?)(?=\[/nation\])', amended_line.lower())
-
-                else:
-                    # this will break with names like "Sch'tz and West Runk'land"
-                    coauthors = re.split(r'(,? and )|(, )', coauthor_line, re.IGNORECASE)
-                    coauthors = [i for i in coauthors if i is not None and i.strip() != 'and']  # post facto patching...
-
-                coauthors = [ref(s).replace('.', '') for s in coauthors]  # cast to reference name
+                coauthors = split_coauthor_line(coauthor_line)
                 print(f'\tidentified coauthors as {coauthors}')
 
                 # pass each co-author in turn
@@ -337,72 +420,383 @@ class WaPassedResolution:
                 except IndexError:
                     pass
 
-        cacher.save()
+        instrument.count('parse.resolutions')
         return resolution
 
 
-def get_count() -> int:
-    soup = BeautifulSoup(call_api('http://forum.nationstates.net/viewtopic.php?f=9&t=30'), 'lxml')
-    resolution = soup.select('div#p310 div.content a')
-    return len(resolution)
+def _api_url(res_num, council=1):
+    return 'https://www.nationstates.net/cgi-bin/api.cgi?wa={}&id={}&q=resolution'.format(council, res_num)
+
+
+class FetchStats:
+    """ Tracks how many requests actually went out to the API, how many of them were answered with 304 Not Modified,
+    how many resolutions came straight from the cache, and how long it took, so the achieved request rate can be
+    compared against the rate limit on `call_api`. """
+    FETCHED = 200
+    NOT_MODIFIED = 304
+    CACHE_HIT = 'cache'
+
+    def __init__(self):
+        self.fetched = 0
+        self.not_modified = 0
+        self.cache_hits = 0
+        self.start = time.perf_counter()
+        self.end = None
+
+    def record(self, outcome):
+        if outcome == FetchStats.FETCHED:
+            self.fetched += 1
+        elif outcome == FetchStats.NOT_MODIFIED:
+            self.not_modified += 1
+        elif outcome == FetchStats.CACHE_HIT:
+            self.cache_hits += 1
+        else:
+            raise ValueError(f'fetch outcome {outcome} invalid')
+
+    def stop(self):
+        self.end = time.perf_counter()
 
+    @property
+    def requests(self):
+        return self.fetched + self.not_modified
+
+    @property
+    def wall_time(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def requests_per_second(self):
+        return self.requests / self.wall_time if self.wall_time > 0 else 0.0
+
+    def __str__(self):
+        return '{} requests ({} 200, {} 304), {} cache hits in {:.1f} s; {:.2f} req/s (limit {:.2f} req/s)'.format(
+            self.requests, self.fetched, self.not_modified, self.cache_hits, self.wall_time,
+            self.requests_per_second, _RATE_LIMIT_CALLS / _RATE_LIMIT_PERIOD
+        )
 
-def parse() -> 'pd.DataFrame':
-    # find the number of resolutions from Passed GA Resolutions
-    passed_res_max = get_count()
-    print(f'found {passed_res_max} resolutions')
 
-    # confirm that we have X resolutions
-    res_list = []
-    max_res = -1
-    for i in range(passed_res_max - 1, passed_res_max + 20):  # passed resolutions should never be more than 20 behind
+def fetch_resolutions(numbers, council=1, workers=8, stats=None, refresh=False, cacher=None, flush_every=100):
+    """ Fetches resolutions concurrently and yields them in the order given by `numbers`. Every worker goes through
+    the same rate-limited `call_api`, so `workers` only controls how many requests are in flight at once; the limit
+    itself is still shared. Responses are decoded and cached on the calling thread. If `refresh`, cached responses are
+    revalidated with a conditional request and replaced if they have changed.
+
+    The `cacher` is flushed after every `flush_every` new responses and once more at the end. If none is given, one is
+    opened for the duration of the fetch. """
+    if cacher is None:
+        with wa_cacher.open_cache() as cacher:
+            yield from fetch_resolutions(numbers, council, workers, stats, refresh, cacher, flush_every)
+        return
+
+    own_stats = stats is None
+    if own_stats:
+        stats = FetchStats()
+
+    numbers = list(numbers)
+    urls = [_api_url(i, council) for i in numbers]
+
+    def fetch(url):
+        if cacher.contains(url):
+            if not refresh:
+                return cacher.get(url), None, FetchStats.CACHE_HIT
+
+            response, meta = call_api_conditional(url, cacher.get_meta(url))
+            if response is None:
+                return cacher.get(url), meta, FetchStats.NOT_MODIFIED
+            return response, meta, FetchStats.FETCHED
+
+        response, meta = call_api_conditional(url)
+        return response, meta, FetchStats.FETCHED
+
+    updated = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for res_num, url, (response, meta, outcome) in zip(numbers, urls, executor.map(fetch, urls)):
+                resolution = WaPassedResolution.from_response(res_num, response, council)
+                stats.record(outcome)
+                if outcome == FetchStats.FETCHED:
+                    cacher.update(url, response, meta=meta)  # only cache responses which decode properly
+                    updated += 1
+                    if updated % flush_every == 0:
+                        cacher.flush()
+                yield resolution
+
+    finally:
+        cacher.flush()
+        if own_stats:
+            stats.stop()
+        print(f'fetched resolutions: {stats}')
+
+
+def _cached_numbers(cacher, council=1) -> list:
+    """ Numbers of the resolutions in the cache, sorted, leaving out 0 (the resolution at vote) """
+    url_pattern = re.compile(re.escape(_api_url(0, council)).replace('id=0', r'id=(\d+)') + '$')
+    numbers = sorted(int(m.group(1)) for m in map(url_pattern.match, cacher.keys()) if m is not None)
+    return [i for i in numbers if i > 0]
+
+
+def _has_passed(res_num, council=1, cacher=None, stats=None) -> bool:
+    """ Whether resolution `res_num` exists, from the cache if it is there and otherwise from the API """
+    try:
+        WaPassedResolution.parse_ga(res_num, council, cacher, stats)
+        return True
+    except NoSuchResolution:
+        return False
+
+
+@instrument.timed('api.find_latest')
+def find_latest(council=1, start=None, cacher=None, stats=None) -> int:
+    """ Number of the newest passed resolution. The search starts from `start`, by default the last resolution in the
+    latest database or the cache, whichever is higher; it gallops forward, doubling the step until it overshoots, and
+    then bisects back, so it takes about two requests per doubling of the resolutions passed since. Resolutions in the
+    cache are taken as passed without a request. Returns 0 if there are none. """
+    if cacher is None:
+        with wa_cacher.open_cache() as cacher:
+            return find_latest(council, start, cacher, stats)
+
+    if start is None:
+        cached = _cached_numbers(cacher, council)
+        start = cached[-1] if cached else 0
         try:
-            print(f'gettingGA {i + 1} of {passed_res_max} predicted resolutions')
-            d = WaPassedResolution.parse_ga(i + 1).__dict__  # note that 0 returns resolution at vote, need to 1-index
-            res_list.append(d)
+            start = max(start, int(pd.read_csv(latest_database(), usecols=['Number'])['Number'].max()))
         except ValueError:
-            print('out of resolutions; data should be complete')
-            max_res = i
-            break
-
-    print(f'found {max_res} resolutions; getting historical')
-
-    # get API information for each resolution
-    for i in reversed(range(0, passed_res_max - 1)):  # passed_res_max is already called above
-        print(f'got {max_res - passed_res_max + i} of {max_res} resolutions')
-        print(f'getting GA {i + 1}')
-        r = WaPassedResolution.parse_ga(i + 1)  # note that 0 returns resolution at vote, need to 1-index
-        d = r.__dict__  # hacky cheating to get into dict
-        res_list.append(d)
-
-    # put it up in pandas
-    df = pd.DataFrame(res_list).replace({None: np.nan})
-    df.drop(columns=['text'], inplace=True)
-    df.rename(columns={
-        'council': 'Council',  # Auralia used these names for columns
-        'resolution_num': 'Number',
-        'title': 'Title',
-        'category': 'Category',
-        'strength': 'Sub-category',
-        'votes_for': 'Votes For',
-        'votes_against': 'Votes Against',
-        'implementation': 'Date Implemented',
-        'author': 'Author'
-    }, inplace=True)
-    df.sort_values(by='Number', inplace=True)
-
-    def join_coauthors(coauthor_list, j=', '):
-        """ Removes empty/whitespace-only strings and then joins """
-        authors = [s for s in coauthor_list if s.strip() != '']
-        return j.join(authors)
-
-    df['Co-authors'] = df[['coauthor0', 'coauthor1', 'coauthor2']] \
-        .replace({np.nan: ''}) \
-        .agg(join_coauthors, axis=1)
-
-    assert all(df['Sub-category'] != '0'), 'resolutions {} have sub-category 0'.format(
-        df.loc[df['Sub-category'] != '0', 'Title'].values
-    )
+            pass  # no database yet
+
+    # low has passed, high has not
+    if start > 0 and not _has_passed(start, council, cacher, stats):
+        low, high = 0, start  # start is past the end, eg from a database of another council
+    else:
+        low, step = start, 1
+        while _has_passed(low + step, council, cacher, stats):
+            low, step = low + step, step * 2
+        high = low + step
+
+    while high - low > 1:
+        middle = (low + high) // 2
+        if _has_passed(middle, council, cacher, stats):
+            low = middle
+        else:
+            high = middle
+
+    return low
+
+
+def parse(workers=8, cacher=None, checkpoint_directory=fetch_checkpoint.DEFAULT_DIRECTORY, poll=10) -> 'pd.DataFrame':
+    """ Parses all resolutions. Historical resolutions are fetched with `workers` concurrent requests; set it to 1 to
+    fetch them one at a time. The API cache is opened once for the whole run unless a `cacher` is given.
+
+    Progress is checkpointed in `checkpoint_directory` block by block (see `fetch_checkpoint`), so a run which dies
+    resumes where it stopped. Blocks claimed by workers in other processes are waited for, checking every `poll`
+    seconds. The checkpoint is deleted once every resolution is in. """
+    if cacher is None:
+        with wa_cacher.open_cache() as cacher:
+            return parse(workers, cacher, checkpoint_directory, poll)
+
+    stats = FetchStats()
+
+    latest = find_latest(cacher=cacher, stats=stats)
+    if latest == 0:
+        raise ApiError('no passed resolutions found')
+    print(f'found {latest} resolutions; getting historical')
+
+    # get API information for each resolution; the newest were cached while finding the count
+    with fetch_checkpoint.FetchCheckpoint(checkpoint_directory) as checkpoint:
+        if checkpoint.records:
+            print(f'resuming from checkpoint; {len(checkpoint.records)} resolutions already fetched')
+
+        while not checkpoint.is_complete(latest):
+            block = checkpoint.claim(latest)
+            if block is None:  # the rest are being fetched by other workers
+                time.sleep(poll)
+                checkpoint.reload()
+                continue
+
+            numbers = reversed(checkpoint.pending(block, latest))
+            for r in fetch_resolutions(numbers, workers=workers, cacher=cacher, stats=stats):
+                print(f'got GA {r.resolution_num} of {latest} resolutions')
+                checkpoint.record(r.to_record())
+            checkpoint.release(block)
+
+        columns = ResolutionColumns()
+        columns.extend(WaPassedResolution.from_record(checkpoint.records[i]) for i in range(1, latest + 1))
+        df = columns.to_frame()
+        checkpoint.clear()  # only once the frame is built; if that fails, the fetched records are kept
+
+    stats.stop()
+    print(f'parsed resolutions: {stats}')
+
+    return df
+
+
+def parse_incremental(base_path=None, workers=8, cacher=None) -> 'pd.DataFrame':
+    """ Updates the latest resolutions database instead of rebuilding it from GA 1. Only resolutions after the last
+    one in that database are fetched, along with the targets of any new repeals, which are re-pulled from the API
+    rather than the cache. Falls back to `parse` if there is no database to update. """
+    if cacher is None:
+        with wa_cacher.open_cache() as cacher:
+            return parse_incremental(base_path, workers, cacher)
+
+    if base_path is None:
+        try:
+            base_path = latest_database()
+        except ValueError:
+            print('no resolutions database found; parsing everything')
+            return parse(workers=workers, cacher=cacher)
+
+    # read as strings so that untouched rows are written back exactly as they were
+    old_df = pd.read_csv(base_path, dtype=str, keep_default_na=False)
+    last_res = old_df['Number'].astype(int).max()
+    print(f'loaded {len(old_df)} resolutions from {base_path}; last is GA {last_res}')
+
+    stats = FetchStats()
+    latest = find_latest(start=last_res, cacher=cacher, stats=stats)
+    new_list = list(fetch_resolutions(range(last_res + 1, latest + 1), workers=workers, cacher=cacher, stats=stats))
+
+    # targets of new repeals have changed status, so the cached responses for them are stale
+    repeal_targets = sorted({int(r.repeals) for r in new_list if r.is_repeal and int(r.repeals) <= last_res})
+    print(f'found {len(new_list)} new resolutions; refreshing repealed resolutions {repeal_targets}')
+    new_list.extend(fetch_resolutions(repeal_targets, workers=workers, refresh=True, cacher=cacher, stats=stats))
+    stats.stop()
+    print(f'parsed resolutions: {stats}')
+
+    if len(new_list) == 0:
+        return old_df
+
+    new_df = _to_frame(new_list).astype(str)
+    df = pd.concat([old_df[~old_df['Number'].isin(new_df['Number'])], new_df])
+    return df.sort_values(by='Number', key=lambda c: c.astype(int)).reset_index(drop=True)
+
+
+def _decode_cached(args):
+    """ Decodes one cached response in a worker process; module level so that it can be pickled. Returns `None` if
+    the response holds no resolution; a malformed resolution raises. """
+    res_num, response, council = args
+    try:
+        return WaPassedResolution.from_response(res_num, response, council)
+    except NoSuchResolution:
+        return None
+
+
+def rebuild_from_cache(council=1, workers=None, cacher=None) -> 'pd.DataFrame':
+    """ Re-derives the resolutions database from the API cache alone, eg after changing how names are capitalised or
+    co-authors are found. Responses are decoded on a process pool of `workers` (default one per CPU). Nothing is
+    fetched; resolutions missing from the cache are reported and left out. """
+    if cacher is None:
+        with wa_cacher.open_cache() as cacher:
+            return rebuild_from_cache(council, workers, cacher)
+
+    numbers = _cached_numbers(cacher, council)
+    if not numbers:
+        raise ValueError(f'cache for council {council} invalid; it holds no resolutions')
+
+    missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+    if missing:
+        print(f'resolutions {missing} are not cached; rebuilding without them')
+
+    start = time.perf_counter()
+    jobs = ((i, cacher.get(_api_url(i, council)), council) for i in numbers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        decoded = list(executor.map(_decode_cached, jobs, chunksize=32))
+
+    undecodable = [i for i, d in zip(numbers, decoded) if d is None]
+    if undecodable:
+        print(f'cached responses for resolutions {undecodable} hold no resolution; rebuilding without them')
+    res_list = [r for r in decoded if r is not None]
+    print(f'rebuilt {len(res_list)} resolutions from the cache in {time.perf_counter() - start:.2f} s')
+    return _to_frame(res_list)
+
+
+def diff_databases(old_df: 'pd.DataFrame', new_df: 'pd.DataFrame') -> 'pd.DataFrame':
+    """ Cell by cell differences between two resolutions databases, compared as they would be written to CSV. Returns
+    a frame of Number, Column, Old, New; a resolution in only one of them is listed with Column `None`. """
+    def as_written(df):
+        df = pd.read_csv(io.StringIO(df.to_csv(index=False)), dtype=str, keep_default_na=False)
+        return df.set_index(df['Number'].astype(int)).sort_index()
+
+    old_df, new_df = as_written(old_df), as_written(new_df)
+    rows = [{'Number': i, 'Column': None, 'Old': 'missing', 'New': 'added'}
+            for i in new_df.index.difference(old_df.index)]
+    rows += [{'Number': i, 'Column': None, 'Old': 'present', 'New': 'removed'}
+             for i in old_df.index.difference(new_df.index)]
+
+    common = old_df.index.intersection(new_df.index)
+    for column in new_df.columns.intersection(old_df.columns):
+        old_values, new_values = old_df.loc[common, column], new_df.loc[common, column]
+        for i in common[(old_values != new_values).values]:
+            rows.append({'Number': i, 'Column': column, 'Old': old_values[i], 'New': new_values[i]})
+
+    return pd.DataFrame(rows, columns=['Number', 'Column', 'Old', 'New']).sort_values('Number', kind='stable')
+
+
+class ResolutionColumns:
+    """ The resolutions database as it is parsed, one typed buffer per column, so that the data frame is built at the
+    end without going through a dict and an object column for every resolution """
+
+    def __init__(self):
+        self.numbers = array('q')
+        self.votes_for = array('q')
+        self.votes_against = array('q')
+        self.implemented = array('q')  # unix time
+        self.titles = []
+        self.categories = []
+        self.strengths = []
+        self.authors = []
+        self.coauthors = []  # lists of names
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def append(self, resolution: 'WaPassedResolution'):
+        self.numbers.append(resolution.resolution_num)
+        self.votes_for.append(resolution.votes_for)
+        self.votes_against.append(resolution.votes_against)
+        self.implemented.append(int(resolution.implementation.timestamp()))
+        self.titles.append(resolution.title)
+        self.categories.append(resolution.category)
+        self.strengths.append(resolution.strength)
+        self.authors.append(resolution.author)
+        self.coauthors.append([s for s in (resolution.coauthor0, resolution.coauthor1, resolution.coauthor2)
+                               if s is not None and s.strip() != ''])  # drop empty/whitespace-only names
+
+    def extend(self, resolutions):
+        for r in resolutions:
+            self.append(r)
+
+    @instrument.timed('parse.to_frame')
+    def to_frame(self) -> 'pd.DataFrame':
+        """ The data frame with the database columns, sorted by number """
+        df = pd.DataFrame({
+            'Number': _int_column(self.numbers),  # Auralia used these names for columns
+            'Title': _text_column(self.titles),
+            'Category': _text_column(self.categories),
+            'Sub-category': _text_column(self.strengths),
+            'Author': _text_column(self.authors),
+            'Co-authors': pd.Series(self.coauthors, dtype=object).str.join(', '),
+            'Votes For': _int_column(self.votes_for),
+            'Votes Against': _int_column(self.votes_against),
+            'Date Implemented': pd.to_datetime(_int_column(self.implemented), unit='s', utc=True)
+                                  .tz_convert('US/Eastern')
+        })
+
+        assert all(df['Sub-category'] != '0'), 'resolutions {} have sub-category 0'.format(
+            df.loc[df['Sub-category'] == '0', 'Title'].values
+        )
+
+        return df.sort_values(by='Number', kind='stable').reset_index(drop=True)
+
+
+def _int_column(values: array) -> np.ndarray:
+    """ Copies an int64 buffer out to numpy, so that the buffer can still grow afterwards """
+    return np.frombuffer(values, dtype=np.int64).copy()
+
+
+def _text_column(values) -> 'pd.Series':
+    """ Strings with missing values as NaN, as they were when the frame was built from dicts """
+    return pd.Series(values, dtype=object).fillna(np.nan)
+
 
-    return df[['Number', 'Title', 'Category', 'Sub-category', 'Author', 'Co-authors',
-               'Votes For', 'Votes Against', 'Date Implemented']].copy()  # take only relevant vars
+def _to_frame(resolutions) -> 'pd.DataFrame':
+    """ Puts parsed resolutions into a data frame with the database columns """
+    columns = ResolutionColumns()
+    columns.extend(resolutions)
+    return columns.to_frame()